@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+
+
+"""Compare the pivot and the columnar conversion of decentlab_client on a synthetic
+payload shaped like an InfluxDB response.
+
+"""
+
+
+import argparse
+import timeit
+
+import numpy as np
+import pandas as pd
+
+from dataaccess import decentlab_client
+
+
+def synthetic_series(n_series: int, n_values: int, seed: int = 0) -> list:
+    """Series of 1-minute data with gaps, missing values and a few duplicates."""
+    rng = np.random.default_rng(seed)
+    start = 1559347200000  # 2019-06-01 00:00:00 UTC
+    series = []
+    for i in range(n_series):
+        time = start + 60000 * np.sort(
+            rng.choice(2 * n_values, n_values, replace=False)
+        )
+        time[1] = time[0]
+        value = rng.normal(size=n_values).round(3).tolist()
+        for j in rng.choice(n_values, n_values // 100, replace=False):
+            value[j] = None
+        series.append(
+            {
+                "name": "measurements",
+                "tags": {"uqk": f"{i:04d}.sensor-{i % 7}"},
+                "columns": ["time", "value"],
+                "values": [[int(t), v] for t, v in zip(time, value)],
+            }
+        )
+    return series
+
+
+def main(args: argparse.Namespace) -> None:
+    series = synthetic_series(args.series, args.values)
+
+    pivot = decentlab_client.series_to_frame(series, columnar=False)
+    columnar = decentlab_client.series_to_frame(series, columnar=True)
+    pd.testing.assert_frame_equal(pivot, columnar)
+
+    for columnar in [False, True]:
+        seconds = min(
+            timeit.repeat(
+                lambda: decentlab_client.series_to_frame(series, columnar=columnar),
+                number=1,
+                repeat=args.repeat,
+            )
+        )
+        print(
+            f"{'columnar' if columnar else 'pivot':>8}: {seconds:.3f} s "
+            f"({args.series} series x {args.values} values)"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-s", "--series", type=int, default=300)
+    parser.add_argument("-v", "--values", type=int, default=2000)
+    parser.add_argument("-r", "--repeat", type=int, default=3)
+
+    args = parser.parse_args()
+
+    main(args)
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+
+
+"""Compare cold (one connection per query) and warm (shared read-only connection)
+query times of example_queries on a generated data slice.
+
+"""
+
+
+import argparse
+import pathlib
+import sqlite3
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from dataaccess import example_queries
+
+
+SCHEMA = """
+CREATE TABLE site (site_id INTEGER PRIMARY KEY, name TEXT);
+CREATE TABLE variable (variable_id INTEGER PRIMARY KEY, name TEXT, unit TEXT);
+CREATE TABLE source_type (
+    source_type_id INTEGER PRIMARY KEY, name TEXT, description TEXT
+);
+CREATE TABLE source (
+    source_id INTEGER PRIMARY KEY,
+    name TEXT,
+    description TEXT,
+    source_type_id INTEGER REFERENCES source_type (source_type_id)
+);
+CREATE TABLE special_value_definition (
+    special_value_definition_id INTEGER PRIMARY KEY, description TEXT
+);
+CREATE TABLE signal (
+    signal_id INTEGER PRIMARY KEY,
+    timestamp TEXT,
+    value REAL,
+    variable_id INTEGER REFERENCES variable (variable_id),
+    source_id INTEGER REFERENCES source (source_id),
+    site_id INTEGER REFERENCES site (site_id)
+);
+"""
+
+SITES = ["rub_morg", "11e_russikerstr", "ara_flatroof", "coop_grundstr"]
+VARIABLES = [
+    ("water_temperature", "°C"),
+    ("water_level", "m"),
+    ("rainfall_intensity", "mm/h"),
+    ("flow_rate", "l/s"),
+]
+SOURCE_TYPES = ["DS18B20", "Keller", "RainGauge", "Flowmeter"]
+
+
+def create_synthetic_slice(
+    db_file: pathlib.Path,
+    n_sources: int = 40,
+    n_minutes: int = 30 * 24 * 60,
+    start: str = "2021-09-01",
+    seed: int = 0,
+) -> pathlib.Path:
+    """Write a data slice with the schema of the UWO slices and random signals.
+
+    Every source records one variable at one site every few minutes.
+
+    """
+    rng = np.random.default_rng(seed)
+    with sqlite3.connect(db_file) as conn:
+        conn.executescript(SCHEMA)
+        conn.executemany("INSERT INTO site VALUES (?, ?)", enumerate(SITES))
+        conn.executemany(
+            "INSERT INTO variable VALUES (?, ?, ?)",
+            [(i, name, unit) for i, (name, unit) in enumerate(VARIABLES)],
+        )
+        conn.executemany(
+            "INSERT INTO source_type VALUES (?, ?, ?)",
+            [(i, name, f"{name} sensor") for i, name in enumerate(SOURCE_TYPES)],
+        )
+        conn.executemany(
+            "INSERT INTO source VALUES (?, ?, ?, ?)",
+            [
+                (i, f"b{'tlfn'[i % 4]}_dl{i:03d}_{SITES[i % len(SITES)]}", "", i % 4)
+                for i in range(n_sources)
+            ],
+        )
+        conn.execute(
+            "INSERT INTO special_value_definition VALUES (0, 'sensor not available')"
+        )
+
+        minutes = pd.date_range(start, periods=n_minutes, freq="1min")
+        for source_id in range(n_sources):
+            interval = [1, 2, 5][source_id % 3]
+            timestamps = minutes[::interval].strftime("%Y-%m-%d %H:%M:%S")
+            conn.executemany(
+                "INSERT INTO signal (timestamp, value, variable_id, source_id, site_id)"
+                " VALUES (?, ?, ?, ?, ?)",
+                zip(
+                    timestamps,
+                    rng.normal(size=len(timestamps)).round(3).tolist(),
+                    [source_id % 4] * len(timestamps),
+                    [source_id] * len(timestamps),
+                    [source_id % len(SITES)] * len(timestamps),
+                ),
+            )
+    return db_file
+
+
+QUERIES = [
+    example_queries.example_query_0,
+    example_queries.example_query_1,
+    example_queries.example_query_2,
+    example_queries.example_query_3,
+]
+
+
+def run(db_file: pathlib.Path, shared: bool, repeat: int) -> float:
+    """Run the queries repeat times, on the shared connection if shared and on
+    a new connection per query otherwise."""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for example_query in QUERIES:
+            example_query(db_file, shared=shared)
+    seconds = time.perf_counter() - start
+    example_queries.CONNECTIONS.close()
+    return seconds
+
+
+def main(args: argparse.Namespace) -> None:
+    with tempfile.TemporaryDirectory() as directory:
+        db_file = create_synthetic_slice(
+            pathlib.Path(directory) / "slice.sqlite",
+            n_sources=args.sources,
+            n_minutes=args.days * 24 * 60,
+        )
+        for shared in [False, True]:
+            seconds = run(db_file, shared, args.repeat)
+            print(
+                f"{'warm' if shared else 'cold'}: {seconds:.3f} s "
+                f"({args.repeat} x {len(QUERIES)} queries)"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-s", "--sources", type=int, default=40)
+    parser.add_argument("-d", "--days", type=int, default=30)
+    parser.add_argument("-r", "--repeat", type=int, default=10)
+
+    args = parser.parse_args()
+
+    main(args)
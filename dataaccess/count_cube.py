@@ -0,0 +1,270 @@
+# coding: utf-8
+
+
+"""Materialized daily and weekly value counts of a data slice.
+
+Counting the values of a slice per source, variable and week scans the whole signal
+table and computes a date string for every row. The count cube does this once and
+stores the result in a sidecar SQLite file next to the slice
+(data_UWO_2019-01_2020-01.sqlite -> data_UWO_2019-01_2020-01.counts.sqlite), the
+slice itself is only read.
+
+The cube holds one row per grain ('D' for days, 'W' for weeks starting on Monday),
+period, source and variable with the number of values and the sum of the
+non-negative values. The largest signal_id counted is kept as watermark, so that
+values appended to the slice later are added by update_cube without a rebuild.
+The number and the first signal_id of the counted signals are kept as fingerprint
+of the slice, the cube is rebuilt if they changed, e.g. because the slice was
+exported anew.
+
+"""
+
+
+import argparse
+import contextlib as ctlib
+import pathlib
+import sqlite3
+
+import pandas as pd
+
+
+# increase when the cube counts differently, results derived from the cube are
+# cached under it (see figure_4_right.HEATMAP_CACHE_KEY)
+CUBE_VERSION = 1
+
+CUBE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS count_cube (
+    grain TEXT NOT NULL,
+    period TEXT NOT NULL,
+    source_name TEXT NOT NULL,
+    variable_name TEXT NOT NULL,
+    value_count INTEGER NOT NULL,
+    positive_sum REAL,
+    PRIMARY KEY (grain, period, source_name, variable_name)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS cube_state (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+
+# the counts of all values of the slice in {schema} with signal_id > :watermark, per day
+DAILY_COUNTS_SELECT = """
+SELECT
+    date(signal.timestamp) AS period,
+    source.name AS source_name,
+    variable.name AS variable_name,
+    COUNT(signal.variable_id) AS value_count,
+    SUM(MAX(signal.value, 0)) AS positive_sum
+FROM {schema}.signal AS signal
+    INNER JOIN {schema}.variable AS variable
+        ON signal.variable_id = variable.variable_id
+    INNER JOIN {schema}.source AS source ON signal.source_id = source.source_id
+WHERE signal.signal_id > :watermark AND signal.signal_id <= :last_id
+GROUP BY date(signal.timestamp), signal.source_id, signal.variable_id
+"""
+
+DAILY_DELTA_QUERY = "\nCREATE TEMP TABLE daily_delta AS" + DAILY_COUNTS_SELECT.format(
+    schema="slice"
+)
+
+# weeks start on Monday, see GRAIN_PERIODS
+UPSERT_QUERY = """
+INSERT INTO count_cube
+SELECT :grain, {period}, source_name, variable_name, SUM(value_count), SUM(positive_sum)
+FROM temp.daily_delta
+WHERE true
+GROUP BY {period}, source_name, variable_name
+ON CONFLICT (grain, period, source_name, variable_name) DO UPDATE SET
+    value_count = value_count + excluded.value_count,
+    positive_sum = coalesce(positive_sum + excluded.positive_sum, positive_sum,
+                            excluded.positive_sum)
+"""
+
+GRAIN_PERIODS = {
+    "D": "period",
+    "W": "date(period, 'weekday 0', '-6 days')",
+}
+
+
+def cube_file_of(db_file: pathlib.Path, cube_dir: pathlib.Path = None) -> pathlib.Path:
+    """The sidecar file of the cube of a slice, in cube_dir instead of next to the
+    slice if given (e.g. if the slices are on a read-only share)."""
+    db_file = pathlib.Path(db_file)
+    if cube_dir is not None:
+        return pathlib.Path(cube_dir) / (db_file.stem + ".counts.sqlite")
+    return db_file.with_name(db_file.stem + ".counts.sqlite")
+
+
+@ctlib.contextmanager
+def open_cube(db_file: pathlib.Path, cube_file: pathlib.Path = None):
+    """A connection to the cube with the slice attached read-only as schema slice."""
+    cube_file = cube_file or cube_file_of(db_file)
+    conn = sqlite3.connect(cube_file)
+    try:
+        conn.executescript(CUBE_SCHEMA)
+        uri = pathlib.Path(db_file).resolve().as_uri() + "?mode=ro"
+        conn.execute("ATTACH DATABASE ? AS slice", (uri,))
+        yield conn
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+def _state(conn) -> dict:
+    return dict(conn.execute("SELECT key, value FROM cube_state").fetchall())
+
+
+def _fingerprint(conn, after_id: int, until_id: int) -> dict:
+    """Number and first signal_id of the signals with after_id < signal_id <= until_id."""
+    row_count, min_id = conn.execute(
+        """
+        SELECT COUNT(*), COALESCE(MIN(signal_id), 0) FROM slice.signal
+        WHERE signal_id > ? AND signal_id <= ?
+        """,
+        (after_id, until_id),
+    ).fetchone()
+    return {"row_count": row_count, "first_id": min_id}
+
+
+def update_cube(db_file: pathlib.Path, cube_file: pathlib.Path = None) -> int:
+    """Add the values appended to the slice since the last update to its cube.
+
+    The cube is rebuilt if the signals counted so far changed, e.g. because the
+    slice was exported anew.
+
+    Returns:
+        The number of values added to the cube.
+
+    """
+    with open_cube(db_file, cube_file) as conn:
+        state = _state(conn)
+        watermark = state.get("watermark", 0)
+        last_id = conn.execute("SELECT MAX(signal_id) FROM slice.signal").fetchone()[0]
+        last_id = last_id or 0
+        fingerprint = _fingerprint(conn, 0, watermark)
+        if last_id < watermark or any(
+            state.get(key) != value for key, value in fingerprint.items()
+        ):
+            conn.execute("DELETE FROM count_cube")
+            watermark = 0
+            fingerprint = {"row_count": 0, "first_id": 0}
+        if last_id == watermark:
+            return 0
+
+        conn.execute(DAILY_DELTA_QUERY, {"watermark": watermark, "last_id": last_id})
+        for grain, period in GRAIN_PERIODS.items():
+            conn.execute(UPSERT_QUERY.format(period=period), {"grain": grain})
+        n_values = conn.execute(
+            "SELECT COALESCE(SUM(value_count), 0) FROM temp.daily_delta"
+        ).fetchone()[0]
+        delta = _fingerprint(conn, watermark, last_id)
+        state = {
+            "watermark": last_id,
+            "row_count": fingerprint["row_count"] + delta["row_count"],
+            "first_id": fingerprint["first_id"] or delta["first_id"],
+        }
+        conn.executemany(
+            "INSERT OR REPLACE INTO cube_state VALUES (?, ?)", state.items()
+        )
+        conn.commit()
+        return n_values
+
+
+def read_cube(
+    db_file: pathlib.Path,
+    grain: str = "W",
+    cube_file: pathlib.Path = None,
+    update: bool = True,
+) -> pd.DataFrame:
+    """The counts of one grain, updated first unless update is False.
+
+    Returns:
+        A frame with the columns value_count, positive_sum, variable_name,
+        source_name and date_trunc (the first day of the period as YYYY-MM-DD),
+        ordered by date_trunc descending.
+
+    """
+    if grain not in GRAIN_PERIODS:
+        raise ValueError(f"Unknown grain {grain}, use one of {list(GRAIN_PERIODS)}.")
+    if update:
+        update_cube(db_file, cube_file)
+    with open_cube(db_file, cube_file) as conn:
+        return pd.read_sql_query(
+            """
+            SELECT
+                value_count,
+                positive_sum,
+                variable_name,
+                source_name,
+                period AS date_trunc
+            FROM count_cube
+            WHERE grain = ?
+            ORDER BY date_trunc DESC
+            """,
+            conn,
+            params=[grain],
+        )
+
+
+def heatmap_counts(
+    db_files: list[pathlib.Path], cube_dir: pathlib.Path = None
+) -> pd.DataFrame:
+    """The weekly counts of several slices, with the columns value_count,
+    variable_name, source_name and date_trunc (the Monday of the week). The cubes
+    are kept in cube_dir if given, see cube_file_of."""
+    return pd.concat(
+        [
+            read_cube(db, "W", cube_file=cube_file_of(db, cube_dir))[
+                ["value_count", "variable_name", "source_name", "date_trunc"]
+            ]
+            for db in db_files
+        ],
+        ignore_index=True,
+    )
+
+
+def totals(db_file: pathlib.Path) -> pd.DataFrame:
+    """Number of values and sum of the non-negative values per source and variable."""
+    daily = read_cube(db_file, "D")
+    return daily.groupby(["source_name", "variable_name"], as_index=False)[
+        ["value_count", "positive_sum"]
+    ].sum()
+
+
+def main(args: argparse.Namespace) -> None:
+    path_to_db = pathlib.Path(args.sourcedirectory)
+    for filename in args.filenames:
+        db = path_to_db / filename
+        cube_file = cube_file_of(db, args.cubedirectory)
+        n_values = update_cube(db, cube_file)
+        print(f"{db}: {n_values} values added to {cube_file}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-sd", "--sourcedirectory", default="/path/to/db_file_directory"
+    )
+    parser.add_argument(
+        "-fn",
+        "--filenames",
+        nargs="+",
+        default=[
+            "data_UWO_2019-01_2020-01.sqlite",
+            "data_UWO_2020-01_2021-01.sqlite",
+            "data_UWO_2021-01_2022-01.sqlite",
+        ],
+    )
+    parser.add_argument(
+        "-cd",
+        "--cubedirectory",
+        default=None,
+        help="directory of the cubes, next to the slices if not given",
+    )
+
+    args = parser.parse_args()
+
+    main(args)
@@ -2,11 +2,22 @@
 
 
 import os
+import re
+import logging
+import asyncio
+import argparse
 import json
+import codecs
+import time
+import random
 import dotenv
 import pathlib
+import threading
+import functools
+import concurrent.futures as cf
 
 import requests
+import numpy as np
 import pandas as pd
 
 
@@ -15,21 +26,49 @@ dotenv.load_dotenv(dotenv_path=pathlib.Path(".env"))
 DOMAIN = os.getenv("DECENTLAB_DOMAIN")
 API_KEY = os.getenv("DECENTLAB_API_KEY")
 
-
-def query(
-    domain: str = DOMAIN,
-    api_key: str = API_KEY,
-    time_filter="",
-    device="//",
-    location="//",
-    sensor="//",
-    include_network_sensors=False,
-    channel="//",
-    agg_func=None,
-    agg_interval=None,
-    do_unstack=True,
-    convert_timestamp=True,
-    timezone="UTC",
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+TIME_BOUND_PATTERN = re.compile(r"time\s*(>=|>|<=|<)\s*'([^']+)'")
+# a filter that consists of exactly two time bounds
+TIME_RANGE_PATTERN = re.compile(
+    r"^\s*(time\s*(?:>=|>|<=|<)\s*'[^']+')\s+AND\s+(time\s*(?:>=|>|<=|<)\s*'[^']+')\s*$",
+    re.IGNORECASE,
+)
+
+INFLUX_AGGREGATES = {
+    "mean": "mean",
+    "median": "median",
+    "sum": "sum",
+    "min": "min",
+    "max": "max",
+    "count": "count",
+    "first": "first",
+    "last": "last",
+    "std": "stddev",
+}
+INFLUX_DURATION_UNITS = [
+    ("d", 86400 * 10**9),
+    ("h", 3600 * 10**9),
+    ("m", 60 * 10**9),
+    ("s", 10**9),
+    ("ms", 10**6),
+    ("u", 10**3),
+]
+
+NON_WHITESPACE = re.compile(r"\S")
+JSON_DECODER = json.JSONDecoder()
+STREAM_BUFFER_SIZE = 1 << 16
+
+
+def _build_query(
+    time_filter,
+    device,
+    location,
+    sensor,
+    include_network_sensors,
+    channel,
+    agg_func,
+    agg_interval,
 ):
     device = "/^" + device + "$/"  # limiting reg expressions
     select_var = "value"
@@ -68,32 +107,639 @@ def query(
         fill,
     )
 
-    r = requests.get(
-        "https://%s/api/datasources/proxy/1/query" % domain,
-        params={"db": "main", "epoch": "ms", "q": q},
-        headers={"Authorization": "Bearer %s" % api_key},
+    return q
+
+
+class _StreamReader:
+    """Incremental reader over an iterable of text chunks of a JSON document.
+
+    Only the unconsumed part of the document is kept in memory.
+
+    """
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self):
+        if self.pos > STREAM_BUFFER_SIZE:
+            self.buf = self.buf[self.pos :]
+            self.pos = 0
+        for chunk in self._chunks:
+            if chunk:
+                self.buf += chunk
+                return True
+        self.eof = True
+        return False
+
+    def find(self, token):
+        """Move behind the next occurrence of token, return False if there is none."""
+        while True:
+            i = self.buf.find(token, self.pos)
+            if i >= 0:
+                self.pos = i + len(token)
+                return True
+            self.pos = max(self.pos, len(self.buf) - len(token) + 1)
+            if not self._fill():
+                return False
+
+    def peek(self):
+        """Return the next non whitespace character without consuming it."""
+        while True:
+            m = NON_WHITESPACE.search(self.buf, self.pos)
+            if m:
+                self.pos = m.start()
+                return self.buf[self.pos]
+            self.pos = len(self.buf)
+            if not self._fill():
+                return ""
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError(
+                "Expected %r at position %d of response." % (char, self.pos)
+            )
+        self.pos += 1
+
+    def decode(self):
+        """Decode the next complete JSON value."""
+        self.peek()
+        while True:
+            try:
+                value, end = JSON_DECODER.raw_decode(self.buf, self.pos)
+                # a number at the end of the buffer might continue in the next chunk
+                if end < len(self.buf) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self._fill()
+
+
+def _rows_to_arrays(times, values):
+    return np.asarray(times, dtype=np.int64), np.asarray(values)
+
+
+def _iter_values(reader, columns, chunk_size):
+    i_time, i_value = columns.index("time"), columns.index("value")
+    reader.expect("[")
+    if reader.peek() == "]":
+        reader.pos += 1
+        return
+
+    times, values = [], []
+    while True:
+        row = reader.decode()
+        times.append(row[i_time])
+        values.append(row[i_value])
+        if len(times) == chunk_size:
+            yield _rows_to_arrays(times, values)
+            times, values = [], []
+        sep = reader.peek()
+        reader.pos += 1
+        if sep == "]":
+            break
+        if sep != ",":
+            raise ValueError("Unexpected %r in values of response." % sep)
+
+    if times:
+        yield _rows_to_arrays(times, values)
+
+
+def _iter_one_series(reader, chunk_size):
+    label, columns, pending = None, ["time", "value"], []
+
+    reader.expect("{")
+    while reader.peek() != "}":
+        key = reader.decode()
+        reader.expect(":")
+        if key == "values":
+            for time, value in _iter_values(reader, columns, chunk_size):
+                if label is None:
+                    pending.append((time, value))
+                else:
+                    yield label, time, value
+        else:
+            item = reader.decode()
+            if key == "tags":
+                label = item["uqk"]
+            elif key == "columns":
+                columns = item
+        if reader.peek() == ",":
+            reader.pos += 1
+    reader.pos += 1
+
+    for time, value in pending:
+        yield label, time, value
+
+
+def iter_series_chunks(text_chunks, chunk_size: int = 100000):
+    """Incrementally parse the series of an InfluxDB response.
+
+    Args:
+        text_chunks: Iterable over the text of the response.
+        chunk_size: Maximal number of values per yielded chunk.
+
+    Yields:
+        Tuples (uqk, time, value) with the epoch milliseconds and the values of
+        up to chunk_size consecutive rows of a series as NumPy arrays.
+
+    """
+    reader = _StreamReader(text_chunks)
+    if not reader.find('"series"'):
+        return
+    reader.expect(":")
+    reader.expect("[")
+    while reader.peek() != "]":
+        yield from _iter_one_series(reader, chunk_size)
+        if reader.peek() == ",":
+            reader.pos += 1
+
+
+class DecentlabClient:
+    """Connection pooled client for the query endpoint of the Decentlab proxy.
+
+    Requests are sent through a single keep-alive session. Responses with a status
+    in RETRY_STATUS and connection errors are retried with exponential backoff
+    and full jitter. The counters requests, retries and bytes_received show
+    where the download time goes. bytes_received is the size of the response
+    bodies after content decoding, not the compressed size on the wire.
+
+    Args:
+        domain: Domain of the Decentlab instance.
+        api_key: API key used as bearer token.
+        timeout: Connect and read timeout in seconds passed to requests.
+        max_retries: Number of retries before an error is raised.
+        backoff_factor: Base of the backoff in seconds, doubled for every retry.
+        max_backoff: Upper limit of a single backoff in seconds.
+        pool_maxsize: Number of connections kept open, should be at least the
+            number of threads using the client.
+
+    """
+
+    def __init__(
+        self,
+        domain: str = DOMAIN,
+        api_key: str = API_KEY,
+        timeout: tuple = (10, 300),
+        max_retries: int = 5,
+        backoff_factor: float = 1.0,
+        max_backoff: float = 60.0,
+        pool_maxsize: int = 10,
+    ):
+        self.url = "https://%s/api/datasources/proxy/1/query" % domain
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+
+        self.session = requests.Session()
+        self.session.mount(
+            "https://",
+            requests.adapters.HTTPAdapter(
+                pool_connections=1, pool_maxsize=pool_maxsize
+            ),
+        )
+        self.session.headers.update({"Authorization": "Bearer %s" % api_key})
+
+        self.requests = 0
+        self.retries = 0
+        self.bytes_received = 0
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.session.close()
+
+    def _count(self, n_requests=0, retries=0, bytes_received=0):
+        with self._lock:
+            self.requests += n_requests
+            self.retries += retries
+            self.bytes_received += bytes_received
+
+    def _backoff(self, attempt, response=None):
+        delay = random.uniform(
+            0, min(self.max_backoff, self.backoff_factor * 2**attempt)
+        )
+        if response is not None:
+            retry_after = response.headers.get("Retry-After", "")
+            if retry_after.isdigit():
+                delay = max(delay, float(retry_after))
+        time.sleep(delay)
+
+    def get(self, q: str, **kwargs) -> requests.Response:
+        """Send a query and return the response, retrying transient failures."""
+        params = {"db": "main", "epoch": "ms", "q": q}
+        for attempt in range(self.max_retries + 1):
+            self._count(n_requests=1)
+            try:
+                r = self.session.get(
+                    self.url, params=params, timeout=self.timeout, **kwargs
+                )
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt == self.max_retries:
+                    raise
+                self._count(retries=1)
+                self._backoff(attempt)
+                continue
+
+            if r.status_code in RETRY_STATUS and attempt < self.max_retries:
+                self._count(retries=1)
+                r.close()
+                self._backoff(attempt, r)
+                continue
+
+            r.raise_for_status()
+            return r
+
+    def fetch_series(self, q: str) -> list:
+        """Run a query and return the series of the first result."""
+        r = self.get(q)
+        self._count(bytes_received=len(r.content))
+
+        data = json.loads(r.text)
+
+        if "results" not in data or "series" not in data["results"][0]:
+            return []
+            # raise ValueError("No series returned: %s" % r.text)
+
+        return data["results"][0]["series"]
+
+    def stream_series(self, q: str, chunk_size: int = 100000):
+        """Run a query and incrementally parse the streamed response.
+
+        The response is never held in memory as a whole, see iter_series_chunks
+        for the yielded chunks.
+
+        """
+        r = self.get(q, stream=True)
+        decoder = codecs.getincrementaldecoder(r.encoding or "utf-8")()
+
+        def _text_chunks():
+            with r:
+                for chunk in r.iter_content(chunk_size=STREAM_BUFFER_SIZE):
+                    self._count(bytes_received=len(chunk))
+                    yield decoder.decode(chunk)
+                yield decoder.decode(b"", final=True)
+
+        yield from iter_series_chunks(_text_chunks(), chunk_size=chunk_size)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "retries": self.retries,
+                "bytes_received": self.bytes_received,
+            }
+
+
+_CLIENTS = {}
+_CLIENTS_LOCK = threading.Lock()
+
+
+def get_client(domain: str = DOMAIN, api_key: str = API_KEY) -> DecentlabClient:
+    """Return the shared client for domain and api_key, creating it on first use."""
+    with _CLIENTS_LOCK:
+        if (domain, api_key) not in _CLIENTS:
+            _CLIENTS[(domain, api_key)] = DecentlabClient(domain, api_key)
+        return _CLIENTS[(domain, api_key)]
+
+
+def split_time_filter(time_filter, chunk_interval):
+    """Split a time filter into consecutive windows of length chunk_interval.
+
+    Only filters of the form "time >= '<start>' AND time <= '<end>'" (with any of
+    the operators >=, >, <=, <) and no further conditions can be split. The
+    windows are half open, only the first and the last window keep the operators
+    of the original filter.
+
+    Returns:
+        A list of time filters, or None if the filter can not be split or its
+        start is after its end.
+
+    """
+    match = TIME_RANGE_PATTERN.match(time_filter)
+    if match is None:
+        return None
+
+    lower, upper = None, None
+    for bound in match.groups():
+        ((op, value),) = TIME_BOUND_PATTERN.findall(bound)
+        if op.startswith(">"):
+            lower = (op, pd.Timestamp(value))
+        else:
+            upper = (op, pd.Timestamp(value))
+
+    if lower is None or upper is None or lower[1] > upper[1]:
+        return None
+
+    boundaries = list(pd.date_range(lower[1], upper[1], freq=chunk_interval))
+    if boundaries[-1] != upper[1]:
+        boundaries.append(upper[1])
+
+    def _fmt(timestamp):
+        # RFC3339 with the offset for tz-aware bounds, InfluxQL's
+        # "YYYY-MM-DD HH:MM:SS" form for naive ones
+        if timestamp.tzinfo is not None:
+            return timestamp.isoformat()
+        return timestamp.isoformat(sep=" ")
+
+    windows = []
+    for i, (start, end) in enumerate(zip(boundaries[:-1], boundaries[1:])):
+        lower_op = lower[0] if i == 0 else ">="
+        upper_op = upper[0] if i == len(boundaries) - 2 else "<"
+        windows.append(
+            f"time {lower_op} '{_fmt(start)}' AND time {upper_op} '{_fmt(end)}'"
+        )
+    return windows or [time_filter]
+
+
+def query(
+    domain: str = DOMAIN,
+    api_key: str = API_KEY,
+    time_filter="",
+    device="//",
+    location="//",
+    sensor="//",
+    include_network_sensors=False,
+    channel="//",
+    agg_func=None,
+    agg_interval=None,
+    do_unstack=True,
+    convert_timestamp=True,
+    timezone="UTC",
+    chunk_interval=None,
+    max_workers=4,
+    client: DecentlabClient = None,
+    columnar=True,
+    stream=False,
+    stream_chunk_size=100000,
+):
+    """Query measurements from the Decentlab API.
+
+    If chunk_interval (a pandas offset alias such as "7D") is given, the range of
+    time_filter is split into windows of that length which are fetched
+    concurrently by at most max_workers threads. The result is the same frame as
+    for a single request. When aggregating, chunk_interval should be a multiple of
+    agg_interval so that no aggregation bucket is split between two windows.
+
+    Requests are sent through client, by default the shared client of domain and
+    api_key returned by get_client. See series_to_frame for columnar.
+
+    With stream the responses are parsed incrementally into NumPy chunks of at
+    most stream_chunk_size values (see iter_series_chunks), so the response text
+    and the decoded JSON are never held in memory as a whole.
+
+    """
+    if client is None:
+        client = get_client(domain, api_key)
+
+    time_filters = [time_filter]
+    if chunk_interval is not None:
+        time_filters = split_time_filter(time_filter, chunk_interval) or time_filters
+
+    queries = [
+        _build_query(
+            time_filter=tf,
+            device=device,
+            location=location,
+            sensor=sensor,
+            include_network_sensors=include_network_sensors,
+            channel=channel,
+            agg_func=agg_func,
+            agg_interval=agg_interval,
+        )
+        for tf in time_filters
+    ]
+
+    if stream:
+
+        def fetch(q):
+            return list(client.stream_series(q, chunk_size=stream_chunk_size))
+
+    else:
+        fetch = client.fetch_series
+
+    if len(queries) == 1:
+        series = fetch(queries[0])
+    else:
+        with cf.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            chunks = executor.map(fetch, queries)
+            series = [s for chunk in chunks for s in chunk]
+
+    if not series:
+        return None
+
+    if stream:
+        return chunks_to_frame(
+            series,
+            do_unstack=do_unstack,
+            convert_timestamp=convert_timestamp,
+            timezone=timezone,
+        )
+
+    return series_to_frame(
+        series,
+        do_unstack=do_unstack,
+        convert_timestamp=convert_timestamp,
+        timezone=timezone,
+        columnar=columnar,
     )
 
-    data = json.loads(r.text)
 
-    if "results" not in data or "series" not in data["results"][0]:
+def plan_aggregation(resolution, agg, timezone="UTC"):
+    """Translate a pandas resampling into an InfluxDB aggregation if possible.
+
+    InfluxDB aligns GROUP BY time() buckets to the epoch in UTC, pandas aligns
+    them to midnight in timezone. Both agree for fixed resolutions that divide a
+    day, in other timezones only for resolutions that divide 15 minutes.
+
+    Args:
+        resolution: A pandas offset alias such as "15min" or "1H".
+        agg: Name of the pandas aggregation, a key of INFLUX_AGGREGATES.
+        timezone: Timezone of the resampled frame.
+
+    Returns:
+        A tuple (agg_func, agg_interval) for query, or None if the aggregation
+        has to be done client side.
+
+    """
+    offset = pd.tseries.frequencies.to_offset(resolution)
+    if agg not in INFLUX_AGGREGATES or not isinstance(offset, pd.offsets.Tick):
         return None
-        # raise ValueError("No series returned: %s" % r.text)
 
-    def _ix2df(series):
-        df = pd.DataFrame(series["values"], columns=series["columns"])
-        df["series"] = series["tags"]["uqk"]
+    nanos = offset.nanos
+    limit = pd.Timedelta("1D") if timezone.upper() == "UTC" else pd.Timedelta("15min")
+    if nanos <= 0 or limit.value % nanos != 0:
+        return None
+
+    for unit, unit_nanos in INFLUX_DURATION_UNITS:
+        if nanos % unit_nanos == 0:
+            return INFLUX_AGGREGATES[agg], "%d%s" % (nanos // unit_nanos, unit)
+    return None
+
+
+def query_resampled(resolution, agg="mean", timezone="UTC", pushdown=True, **kwargs):
+    """Query the wide frame of query resampled to resolution with agg.
+
+    The aggregation is pushed down to InfluxDB (GROUP BY time()) when
+    plan_aggregation allows it, otherwise the raw values are fetched and
+    resampled with pandas. Both return the same frame: buckets without any
+    value are dropped, a series without values in a bucket has the count 0 and
+    the sum NaN, as InfluxDB reports it. Further keyword arguments are passed to
+    query, except do_unstack, agg_func and agg_interval which are set here.
+
+    """
+    fixed = {"do_unstack", "agg_func", "agg_interval"}.intersection(kwargs)
+    if fixed:
+        raise TypeError(f"query_resampled sets {', '.join(sorted(fixed))} itself")
+
+    plan = plan_aggregation(resolution, agg, timezone) if pushdown else None
+    if plan is not None:
+        agg_func, agg_interval = plan
+        df = query(
+            agg_func=agg_func,
+            agg_interval=agg_interval,
+            timezone=timezone,
+            do_unstack=True,
+            **kwargs,
+        )
+        if df is not None and agg == "count":
+            # InfluxDB reports null for a series without values in a bucket
+            df = df.fillna(0).astype(np.int64)
         return df
 
-    df = pd.concat(_ix2df(s) for s in data["results"][0]["series"])
+    df = query(timezone=timezone, do_unstack=True, **kwargs)
+    if df is None:
+        return None
+    resampler = df.resample(resolution)
+    if agg == "count":
+        df = resampler.count()
+        return df[(df != 0).any(axis=1)]
+    if agg == "sum":
+        df = resampler.sum(min_count=1)
+    else:
+        df = resampler.agg(agg)
+    return df.dropna(how="all")
+
+
+def _convert_timestamp(time, timezone):
+    time = pd.to_datetime(time, unit="ms", utc=True)
+    try:
+        time = time.dt.tz_localize("UTC")
+    except TypeError:
+        pass
+    return time.dt.tz_convert(timezone)
+
+
+def _series_to_arrays(series):
+    columns = series["columns"]
+    values = series["values"]
+    i_time, i_value = columns.index("time"), columns.index("value")
+    time = np.fromiter(
+        (row[i_time] for row in values), dtype=np.int64, count=len(values)
+    )
+    value = np.asarray([row[i_value] for row in values])
+    return series["tags"]["uqk"], time, value
+
+
+def arrays_to_wide_frame(labels, times, values, convert_timestamp=True, timezone="UTC"):
+    """Assemble the wide (time, series) frame directly from per-series arrays.
+
+    The result is identical to pivoting the long frame with pivot_table: values
+    of the same series and time are averaged, rows and columns without any value
+    are dropped and integer input stays integer if nothing is missing.
+
+    Args:
+        labels: The uqk label of every series.
+        times: Epoch milliseconds of every series as int64 arrays.
+        values: The values of every series as arrays.
+        convert_timestamp: Whether to convert the index to timezone.
+        timezone: Timezone of the index.
+
+    """
+    all_int = all(v.dtype.kind in "iu" for v in values)
+
+    categories = pd.Categorical(labels)
+    col_codes = np.repeat(categories.codes, [len(t) for t in times])
+    row_index, row_codes = np.unique(np.concatenate(times), return_inverse=True)
+
+    value = np.concatenate([v.astype(float) for v in values])
+    valid = ~np.isnan(value)
+
+    n_rows, n_cols = len(row_index), len(categories.categories)
+    flat = row_codes[valid] * n_cols + col_codes[valid]
+    sums = np.bincount(flat, weights=value[valid], minlength=n_rows * n_cols)
+    counts = np.bincount(flat, minlength=n_rows * n_cols)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        wide = (sums / counts).reshape(n_rows, n_cols)
+    wide[(counts == 0).reshape(n_rows, n_cols)] = np.nan
 
+    has_value = ~np.isnan(wide)
+    keep_rows, keep_cols = has_value.any(axis=1), has_value.any(axis=0)
+    wide = wide[keep_rows][:, keep_cols]
+
+    if all_int and not np.isnan(wide).any() and (wide == np.round(wide)).all():
+        wide = wide.astype(np.int64)
+
+    index = pd.Series(row_index[keep_rows], name="time")
     if convert_timestamp:
-        df["time"] = pd.to_datetime(df["time"], unit="ms", utc=True)
+        index = _convert_timestamp(index, timezone)
+
+    return pd.DataFrame(
+        wide,
+        index=pd.Index(index, name="time"),
+        columns=pd.Index(categories.categories[keep_cols], name="series"),
+    )
+
+
+def chunks_to_frame(chunks, do_unstack=True, convert_timestamp=True, timezone="UTC"):
+    """Convert the chunks yielded by iter_series_chunks into a frame.
+
+    The frame is the same as the one series_to_frame returns for the parsed
+    response.
+
+    """
+    labels, times, values = zip(*chunks)
+
+    if do_unstack:
         try:
-            df["time"] = df["time"].dt.tz_localize("UTC")
-        except TypeError:
+            return arrays_to_wide_frame(
+                labels,
+                times,
+                values,
+                convert_timestamp=convert_timestamp,
+                timezone=timezone,
+            )
+        except (TypeError, ValueError):
             pass
-        df["time"] = df["time"].dt.tz_convert(timezone)
+
+    value = np.concatenate(values)
+    if value.dtype == object:
+        try:
+            value = value.astype(float)
+        except (TypeError, ValueError):
+            pass
+
+    df = pd.DataFrame(
+        {
+            "time": np.concatenate(times),
+            "value": value,
+            "series": np.repeat(labels, [len(t) for t in times]),
+        }
+    )
+
+    if convert_timestamp:
+        df["time"] = _convert_timestamp(df["time"], timezone)
 
     df = df.set_index(["time", "series"])
     df = df.sort_index()
@@ -104,52 +750,257 @@ def query(
     return df
 
 
-if __name__ == "__main__":
-    path = pathlib.WindowsPath(
-        r"C:\Users\dischand\switchdrive\UWO\Arbeiten und Artikel\UWO_Data_paper\decentlab_data_correction"
-    )
+def series_to_frame(
+    series,
+    do_unstack=True,
+    convert_timestamp=True,
+    timezone="UTC",
+    columnar=True,
+):
+    """Convert the series of an InfluxDB result into a frame.
 
-    devices = ["317", "319", "319", "330", "331", "907"]
+    With do_unstack the frame is wide with one column per series, otherwise
+    it is long with a (time, series) index. With columnar the wide frame is
+    assembled directly by arrays_to_wide_frame instead of concatenating one
+    frame per series and pivoting. Series with non numeric values always take
+    the pivot path.
 
-    time_filter = (
-        f"time >= '{'2019-06-09 00:00:00'}' AND time <= '{'2019-06-17 23:59:59'}'"
-    )
-    sensor = "/(distance)|(rssi)|(snr)|(counter)|(spreading)|(trials)|(precipitation)|(decagon)|(keller)|(pressure)|(battery)|(rain-gauge-interval)|(rain-gauge-precipitation)|(rain-gauge-precipitation-sum)|(temperature)|(id)/"
+    """
+    if do_unstack and columnar:
+        labels, times, values = zip(*(_series_to_arrays(s) for s in series))
+        try:
+            return arrays_to_wide_frame(
+                labels,
+                times,
+                values,
+                convert_timestamp=convert_timestamp,
+                timezone=timezone,
+            )
+        except (TypeError, ValueError):
+            pass
 
-    for device in devices:
-        df = query(
-            time_filter=time_filter,
-            device=device,
-            sensor=sensor,
-            include_network_sensors=True,
-        )
+    def _ix2df(series):
+        df = pd.DataFrame(series["values"], columns=series["columns"])
+        df["series"] = series["tags"]["uqk"]
+        return df
+
+    df = pd.concat(_ix2df(s) for s in series)
+
+    if convert_timestamp:
+        df["time"] = _convert_timestamp(df["time"], timezone)
+
+    df = df.set_index(["time", "series"])
+    df = df.sort_index()
+
+    if do_unstack:
+        df = df.pivot_table(columns="series", index="time", values="value")
+
+    return df
 
-        new_index = []
-        tz_offset = []
-        for date in df.index.to_list():
-            new_index.append(date.strftime("%Y-%m-%d %H:%M:%S"))
-            tz_offset.append("+" + "".join(str(date).split("+")[1].split(":")) + "")
 
-        df.index = new_index
-        df.index.name = "timestamp"
-        df["tzOffset"] = tz_offset
-        df["tzName"] = "UTC"
+def _format_tz_offsets(index):
+    utc = index.tz_convert("UTC").tz_localize(None)
+    offsets = (index.tz_localize(None) - utc).total_seconds().astype(int)
 
-        df = df[~df.index.duplicated(keep="first")]
-        df = df[~df.iloc[:, 3].isna()]
+    codes, uniques = pd.factorize(offsets)
+    formatted = [
+        "%s%02d%02d" % ("-" if o < 0 else "+", abs(o) // 3600, abs(o) % 3600 // 60)
+        for o in uniques
+    ]
+    return np.asarray(formatted, dtype=object)[codes]
 
-        for column in df.columns:
-            if "bandwidth.link-lora" in column:
-                del df[column]
+
+def _downcast_float_columns(df):
+    # same result as pd.to_numeric(downcast="integer") column by column
+    columns = [c for c in df.columns if df[c].dtype == float]
+    values = df[columns].to_numpy()
+
+    dtypes = {}
+    candidates = np.flatnonzero(~np.isnan(values).any(axis=0))
+    with np.errstate(invalid="ignore", over="ignore"):
+        for dtype in [np.int8, np.int16, np.int32, np.int64]:
+            if not len(candidates):
                 break
+            block = values[:, candidates]
+            close = np.isclose(block.astype(dtype), block, rtol=0).all(axis=0)
+            for i in candidates[close]:
+                dtypes[columns[i]] = dtype
+            candidates = candidates[~close]
+
+    return df.astype(dtypes) if dtypes else df
+
+
+def format_export(df, device, tz_name="UTC"):
+    """Prepare a frame of query for the CSV export of device.
 
-        if not device.startswith("bt_dl"):
-            for column in df.columns:
-                if "maxim-ds18b20-id" in column:
-                    del df[column]
+    Adds the timestamp index and the tzOffset and tzName columns, drops
+    duplicated timestamps, rows without a value in the fourth column and the
+    link bandwidth (and, except for bt_dl devices, the ds18b20 id) columns, and
+    downcasts integral float columns to integers.
+
+    """
+    df = df.copy()
+    index = df.index
+
+    df.index = pd.Index(index.strftime("%Y-%m-%d %H:%M:%S"), name="timestamp")
+    df["tzOffset"] = _format_tz_offsets(index)
+    df["tzName"] = tz_name
+
+    df = df[~df.index.duplicated(keep="first")]
+    df = df[~df.iloc[:, 3].isna()]
+
+    to_drop = [c for c in df.columns if "bandwidth.link-lora" in c][:1]
+    if not device.startswith("bt_dl"):
+        to_drop += [c for c in df.columns if "maxim-ds18b20-id" in c]
+    df = df.drop(columns=to_drop)
+
+    return _downcast_float_columns(df)
+
+
+def export_csv(df, file, chunksize=None):
+    """Write a frame of format_export, in chunks of chunksize rows if given."""
+    df.to_csv(file, sep=";", float_format="%g", decimal=",", chunksize=chunksize)
+
+
+async def _download_device(
+    device, semaphore, target, time_filter, sensor, client, resolution, agg, **kwargs
+):
+    fetch = query
+    if resolution is not None:
+        fetch = functools.partial(query_resampled, resolution, agg=agg)
+
+    async with semaphore:
+        try:
+            # the windows of a device are fetched one after the other, so that at
+            # most one request per device and max_concurrency requests in total run
+            df = await asyncio.to_thread(
+                fetch,
+                time_filter=time_filter,
+                device=device,
+                sensor=sensor,
+                include_network_sensors=True,
+                max_workers=1,
+                client=client,
+                **kwargs,
+            )
+        except requests.RequestException as error:
+            logging.warning(f"Download of device {device} failed: {error}")
+            return device, None
+        if df is None:
+            return device, 0
+        df = format_export(df, device)
+        await asyncio.to_thread(
+            export_csv, df, target / f"{device}.csv", chunksize=100000
+        )
+    return device, len(df)
+
+
+async def download_devices(
+    devices: list,
+    start: str,
+    end: str,
+    sensor: str,
+    target: pathlib.Path,
+    max_concurrency: int = 8,
+    client: DecentlabClient = None,
+    resolution: str = None,
+    agg: str = "mean",
+    **kwargs,
+) -> dict:
+    """Download and export the data of several devices concurrently.
+
+    Duplicated devices are downloaded once. At most max_concurrency requests run
+    at the same time, one per device, the CSV of a device is written as soon as
+    its data arrived. With resolution the data is resampled with agg by
+    query_resampled, in InfluxDB if possible. Further keyword arguments are
+    passed to query.
+
+    A client created here has max_concurrency pooled connections and is closed
+    at the end; a given client should have at least as many.
+
+    Returns:
+        The number of exported rows per device, None if the download failed
+        with an HTTP or connection error. Other errors are raised.
+
+    """
+    if "max_workers" in kwargs:
+        raise TypeError("the concurrency is set with max_concurrency")
+
+    own_client = client is None
+    if own_client:
+        client = DecentlabClient(pool_maxsize=max_concurrency)
+
+    semaphore = asyncio.Semaphore(max_concurrency)
+    time_filter = f"time >= '{start}' AND time <= '{end}'"
+
+    try:
+        tasks = [
+            _download_device(
+                device,
+                semaphore,
+                target,
+                time_filter,
+                sensor,
+                client,
+                resolution,
+                agg,
+                **kwargs,
+            )
+            for device in dict.fromkeys(devices)
+        ]
+
+        results = {}
+        for task in asyncio.as_completed(tasks):
+            device, n_rows = await task
+            results[device] = n_rows
+    finally:
+        if own_client:
+            client.close()
+    return results
+
+
+def main(args: argparse.Namespace) -> None:
+    with DecentlabClient(pool_maxsize=args.concurrency) as client:
+        results = asyncio.run(
+            download_devices(
+                args.devices,
+                start=args.start,
+                end=args.end,
+                sensor=args.sensor,
+                target=pathlib.Path(args.targetdirectory),
+                max_concurrency=args.concurrency,
+                client=client,
+                resolution=args.resolution,
+                agg=args.agg,
+                chunk_interval="1D",
+            )
+        )
+        for device, n_rows in results.items():
+            print(f"{device}: {n_rows} rows")
+        print(client.stats())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-td",
+        "--targetdirectory",
+        default=r"C:\Users\dischand\switchdrive\UWO\Arbeiten und Artikel\UWO_Data_paper\decentlab_data_correction",
+    )
+    parser.add_argument(
+        "-d", "--devices", nargs="+", default=["317", "319", "319", "330", "331", "907"]
+    )
+    parser.add_argument("-s", "--start", default="2019-06-09 00:00:00")
+    parser.add_argument("-e", "--end", default="2019-06-17 23:59:59")
+    parser.add_argument(
+        "-se",
+        "--sensor",
+        default="/(distance)|(rssi)|(snr)|(counter)|(spreading)|(trials)|(precipitation)|(decagon)|(keller)|(pressure)|(battery)|(rain-gauge-interval)|(rain-gauge-precipitation)|(rain-gauge-precipitation-sum)|(temperature)|(id)/",
+    )
+    parser.add_argument("-c", "--concurrency", type=int, default=8)
+    parser.add_argument("-r", "--resolution", default=None)
+    parser.add_argument("-a", "--agg", default="mean")
 
-        for column in df.columns:
-            if df[column].dtype == float:
-                df[column] = pd.to_numeric(df[column], downcast="integer")
+    args = parser.parse_args()
 
-        df.to_csv(path / f"{device}.csv", sep=";", float_format="%g", decimal=",")
+    main(args)
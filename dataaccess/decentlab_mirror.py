@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+
+
+"""Keep an incremental local mirror of Decentlab data.
+
+The mirror stores the data of every device as Parquet files partitioned by month
+(<store>/device=<device>/<YYYY-MM>.parquet) and remembers the last timestamp
+fetched per device in <store>/watermarks.json. Every sync only queries data newer
+than the watermark, downstream scripts can read the mirror with read_mirror.
+
+"""
+
+
+import argparse
+import json
+import pathlib
+
+import pandas as pd
+
+from dataaccess import decentlab_client
+
+
+WATERMARK_FILE = "watermarks.json"
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
+
+
+def _device_directory(store: pathlib.Path, device: str) -> pathlib.Path:
+    return store / f"device={device}"
+
+
+def load_watermarks(store: pathlib.Path) -> dict:
+    """Return the watermark (last UTC timestamp fetched) of every device."""
+    file = store / WATERMARK_FILE
+    if not file.exists():
+        return {}
+    with file.open() as f:
+        return json.load(f)
+
+
+def save_watermarks(store: pathlib.Path, watermarks: dict) -> None:
+    tmp = store / (WATERMARK_FILE + ".tmp")
+    with tmp.open("w") as f:
+        json.dump(watermarks, f, indent=4, sort_keys=True)
+    tmp.replace(store / WATERMARK_FILE)
+
+
+def write_partitions(store: pathlib.Path, device: str, df: pd.DataFrame) -> None:
+    """Merge df into the monthly partitions of device.
+
+    Rows already in the mirror are replaced by the rows of df with the same
+    timestamp.
+
+    """
+    directory = _device_directory(store, device)
+    directory.mkdir(parents=True, exist_ok=True)
+
+    months = df.index.tz_convert("UTC").strftime("%Y-%m")
+    for month, part in df.groupby(months):
+        file = directory / f"{month}.parquet"
+        if file.exists():
+            part = pd.concat([pd.read_parquet(file), part])
+            part = part[~part.index.duplicated(keep="last")].sort_index()
+        part.to_parquet(file)
+
+
+def read_mirror(
+    store: pathlib.Path, device: str, start: str = None, end: str = None
+) -> pd.DataFrame:
+    """Read the mirrored data of device between start and end (UTC, inclusive).
+
+    Returns:
+        The wide (time, series) frame of decentlab_client.query, or None if the
+        mirror holds no data for device.
+
+    """
+    start = pd.Timestamp(start, tz="UTC") if start else None
+    end = pd.Timestamp(end, tz="UTC") if end else None
+
+    files = sorted(_device_directory(store, device).glob("*.parquet"))
+    if start is not None:
+        files = [f for f in files if f.stem >= start.strftime("%Y-%m")]
+    if end is not None:
+        files = [f for f in files if f.stem <= end.strftime("%Y-%m")]
+    if not files:
+        return None
+
+    df = pd.concat(pd.read_parquet(f) for f in files).sort_index()
+    return df.loc[start:end]
+
+
+def sync_device(
+    store: pathlib.Path,
+    device: str,
+    start: str,
+    sensor: str = "//",
+    include_network_sensors: bool = True,
+    lookback: str = "0s",
+    chunk_interval: str = "7D",
+    client: decentlab_client.DecentlabClient = None,
+) -> int:
+    """Fetch the data of device that is newer than its watermark into the mirror.
+
+    Args:
+        store: Directory of the mirror.
+        device: The device to sync.
+        start: First timestamp (UTC) to fetch if the device has no watermark yet.
+        sensor: Regular expression for the sensors, see decentlab_client.query.
+        include_network_sensors: See decentlab_client.query.
+        lookback: Re-fetch this period before the watermark, to catch late data.
+        chunk_interval: Window length of the chunked query.
+        client: Client used for the requests.
+
+    Returns:
+        The number of rows fetched.
+
+    """
+    watermarks = load_watermarks(store)
+    now = pd.Timestamp.now(tz="UTC").strftime(TIME_FORMAT)
+
+    if device in watermarks:
+        since = pd.Timestamp(watermarks[device]) - pd.Timedelta(lookback)
+        time_filter = f"time > '{since.strftime(TIME_FORMAT)}' AND time <= '{now}'"
+    else:
+        time_filter = f"time >= '{start}' AND time <= '{now}'"
+
+    df = decentlab_client.query(
+        time_filter=time_filter,
+        device=device,
+        sensor=sensor,
+        include_network_sensors=include_network_sensors,
+        chunk_interval=chunk_interval,
+        stream=True,
+        client=client,
+    )
+    if df is None or df.empty:
+        return 0
+
+    write_partitions(store, device, df)
+
+    # reload, another device might have been synced in the meantime
+    watermarks = load_watermarks(store)
+    last = df.index.max().tz_convert("UTC").strftime(TIME_FORMAT)
+    watermarks[device] = max(last, watermarks.get(device, last))
+    save_watermarks(store, watermarks)
+
+    return len(df)
+
+
+def main(args: argparse.Namespace) -> None:
+    store = pathlib.Path(args.store)
+    store.mkdir(parents=True, exist_ok=True)
+
+    for device in dict.fromkeys(args.devices):
+        n_rows = sync_device(
+            store,
+            device,
+            start=args.start,
+            sensor=args.sensor,
+            lookback=args.lookback,
+        )
+        print(f"{device}: {n_rows} new rows")
+
+    print(decentlab_client.get_client().stats())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-st", "--store", default="/path/to/mirror")
+    parser.add_argument("-d", "--devices", nargs="+", required=True)
+    parser.add_argument("-s", "--start", default="2019-01-01 00:00:00")
+    parser.add_argument("-se", "--sensor", default="//")
+    parser.add_argument("-lb", "--lookback", default="0s")
+
+    args = parser.parse_args()
+
+    main(args)
@@ -3,12 +3,16 @@
 
 import pendulum
 import argparse
+import atexit
 import pathlib
 import sqlite3
+import threading
 import contextlib as ctlib
 
 import pandas as pd
 
+from dataaccess import count_cube, result_cache
+
 
 @ctlib.contextmanager
 def open_sqlite(db_file):
@@ -22,6 +26,87 @@ def open_sqlite(db_file):
         conn.close()
 
 
+# 256 MiB memory mapped I/O and a 64 MiB page cache per connection
+MMAP_SIZE = 256 * 1024 * 1024
+CACHE_SIZE_KIB = 64 * 1024
+
+
+def open_sqlite_readonly(
+    db_file,
+    immutable: bool = False,
+    mmap_size: int = MMAP_SIZE,
+    cache_size_kib: int = CACHE_SIZE_KIB,
+    query_only: bool = True,
+    check_same_thread: bool = True,
+) -> sqlite3.Connection:
+    """Open a read-only connection tuned for querying large data slices.
+
+    Args:
+        db_file: Path to the SQLite file.
+        immutable: Tell SQLite that the file does not change while it is open, so
+            that no locks are taken. Only use this for files nobody writes to.
+        mmap_size: Maximal number of bytes of the file accessed via mmap.
+        cache_size_kib: Size of the page cache in KiB.
+        query_only: Also refuse changes to temporary tables.
+        check_same_thread: Refuse to use the connection outside of the thread
+            that opened it, see sqlite3.connect.
+
+    Returns:
+        The connection, it has to be closed by the caller.
+
+    """
+    uri = pathlib.Path(db_file).resolve().as_uri() + "?mode=ro"
+    if immutable:
+        uri += "&immutable=1"
+    conn = sqlite3.connect(uri, uri=True, check_same_thread=check_same_thread)
+    conn.execute(f"PRAGMA mmap_size = {int(mmap_size)}")
+    conn.execute(f"PRAGMA cache_size = -{int(cache_size_kib)}")
+    if query_only:
+        conn.execute("PRAGMA query_only = 1")
+    return conn
+
+
+class ConnectionManager:
+    """Keeps one long-lived read-only connection per data slice and thread.
+
+    Reusing the connection keeps the page cache warm between queries. A
+    connection is only handed out to the thread that opened it, as SQLite
+    connections must not be used by several threads at once. The connections
+    are opened with open_sqlite_readonly and closed at exit.
+
+    """
+
+    def __init__(self, **kwargs):
+        self.kwargs = kwargs
+        self._connections = {}
+        self._lock = threading.Lock()
+
+    def get(self, db_file) -> sqlite3.Connection:
+        key = (threading.get_ident(), pathlib.Path(db_file).resolve())
+        with self._lock:
+            conn = self._connections.get(key)
+        if conn is None:
+            # only closed by another thread in close(), which is why the check
+            # of the creating thread is disabled
+            conn = open_sqlite_readonly(key[1], check_same_thread=False, **self.kwargs)
+            with self._lock:
+                self._connections[key] = conn
+        return conn
+
+    def close(self, db_file=None) -> None:
+        """Close the connections of db_file, or all, of every thread."""
+        path = None if db_file is None else pathlib.Path(db_file).resolve()
+        with self._lock:
+            keys = [k for k in self._connections if path is None or k[1] == path]
+            connections = [self._connections.pop(k) for k in keys]
+        for conn in connections:
+            conn.close()
+
+
+CONNECTIONS = ConnectionManager()
+atexit.register(CONNECTIONS.close)
+
+
 def _query_plain(conn, sql_query):
     cur = conn.cursor()
     cur.execute(sql_query)
@@ -42,8 +127,25 @@ def query(
     db_file: pathlib.PosixPath,
     sql_query: str,
     return_dataframe: bool = True,
-    query_args: list[str] = None,
+    query_args=None,
+    shared: bool = True,
+    cache_dir: pathlib.Path = None,
 ):
+    if cache_dir is not None and return_dataframe:
+        return result_cache.ResultCache(cache_dir).get_or_run(
+            db_file,
+            sql_query,
+            query_args,
+            lambda: query(db_file, sql_query, query_args=query_args, shared=shared),
+        )
+
+    if shared:
+        conn = CONNECTIONS.get(db_file)
+        if return_dataframe:
+            return _query_df(conn, sql_query, query_args)
+        else:
+            return _query_plain(conn, sql_query)
+
     with open_sqlite(db_file) as conn:
         if return_dataframe:
             return _query_df(conn, sql_query, query_args)
@@ -51,19 +153,86 @@ def query(
             return _query_plain(conn, sql_query)
 
 
-def example_query_0(db_file: str) -> pd.DataFrame:
-    """List all special values."""
+def _shrink_chunk(chunk, categorical_columns, downcast_floats):
+    # positional access, the package queries return several "name" columns
+    for i, name in enumerate(chunk.columns):
+        column = chunk.iloc[:, i]
+        if pd.api.types.is_integer_dtype(column):
+            chunk.isetitem(i, pd.to_numeric(column, downcast="integer"))
+        elif downcast_floats and pd.api.types.is_float_dtype(column):
+            chunk.isetitem(i, pd.to_numeric(column, downcast="float"))
+        elif name in categorical_columns and column.dtype == object:
+            chunk.isetitem(i, column.astype("category"))
+    return chunk
 
-    example_query = f"""
 
-    SELECT * FROM special_value_definition;
+def query_chunked(
+    db_file: pathlib.PosixPath,
+    sql_query: str,
+    query_args: list[str] = None,
+    chunksize: int = 100000,
+    categorical_columns: tuple = ("name", "unit"),
+    downcast_floats: bool = False,
+):
+    """Iterate over the result of a query in DataFrames of chunksize rows.
+
+    A timestamp column is parsed to datetime, integer columns are downcast and
+    the name and unit columns are categorical, so each chunk takes a fraction
+    of the memory of the plain result. The categories are per chunk.
+    downcast_floats converts values to float32, which loses precision.
+
+    db_file may also be an open connection.
 
     """
+    if isinstance(db_file, sqlite3.Connection):
+        conn = db_file
+    else:
+        conn = CONNECTIONS.get(db_file)
+    for chunk in pd.read_sql_query(
+        sql_query,
+        conn,
+        params=query_args,
+        parse_dates=["timestamp"],
+        chunksize=chunksize,
+    ):
+        yield _shrink_chunk(chunk, categorical_columns, downcast_floats)
+
 
-    return query(db_file, example_query)
+EXAMPLE_QUERY_0 = """
 
+SELECT * FROM special_value_definition;
+
+"""
+
+
+def example_query_0(db_file: str, shared: bool = True) -> pd.DataFrame:
+    """List all special values."""
 
-def example_query_1(db_file: str) -> pd.DataFrame:
+    return query(db_file, EXAMPLE_QUERY_0, shared=shared)
+
+
+EXAMPLE_QUERY_1 = """
+
+SELECT
+    signal.timestamp,
+    value,
+    unit,
+    variable.name,
+    source_type.name,
+    source.name
+FROM signal
+    INNER JOIN site ON signal.site_id = site.site_id
+    INNER JOIN variable ON signal.variable_id = variable.variable_id
+    INNER JOIN source ON signal.source_id = source.source_id
+    INNER JOIN source_type ON source.source_type_id = source_type.source_type_id
+WHERE site.name = :location
+    AND signal.timestamp >= :start_date
+    AND signal.timestamp <= :end_date;
+
+"""
+
+
+def example_query_1(db_file: str, shared: bool = True) -> pd.DataFrame:
     """List all datapoints recorded between 'start_date' and 'end_date' at location '11e_russikerstr'."""
 
     end_date = pendulum.datetime(year=2021, month=9, day=30)
@@ -71,119 +240,119 @@ def example_query_1(db_file: str) -> pd.DataFrame:
 
     location = "rub_morg"
 
-    example_query = f"""
+    return query(
+        db_file,
+        EXAMPLE_QUERY_1,
+        query_args={
+            "location": location,
+            "start_date": str(start_date),
+            "end_date": str(end_date),
+        },
+        shared=shared,
+    )
 
-    SELECT
-        signal.timestamp,
-        value,
-        unit,
-        variable.name,
-        source_type.name,
-        source.name
-    FROM signal
-        INNER JOIN site ON signal.site_id = site.site_id
-        INNER JOIN variable ON signal.variable_id = variable.variable_id
-        INNER JOIN source ON signal.source_id = source.source_id
-        INNER JOIN source_type ON source.source_type_id = source_type.source_type_id
-    WHERE site.name = '{location}'
-        AND signal.timestamp >= '{start_date}'
-        AND signal.timestamp <= '{end_date}';
 
-    """
+EXAMPLE_QUERY_2 = """
 
-    return query(db_file, example_query)
+WITH variable_ids as (
+    SELECT variable_id FROM variable WHERE variable.name = :variable
+), source_ids as (
+    SELECT DISTINCT source_id FROM signal
+    WHERE signal.variable_id IN (
+        SELECT variable_id FROM variable_ids
+    )
+)
+SELECT source.name from source
+WHERE source.source_id IN (
+    SELECT source_id from source_ids
+)
+
+"""
 
 
-def example_query_2(db_file: str) -> pd.DataFrame:
+def example_query_2(db_file: str, shared: bool = True) -> pd.DataFrame:
     """Get all sources that have recordings for variable 'water_temperature'."""
 
     variable = "water_temperature"
 
-    example_query = f"""
-
-    WITH variable_ids as (
-        SELECT variable_id FROM variable WHERE variable.name = '{variable}'
-    ), source_ids as (
-        SELECT DISTINCT source_id FROM signal
-        WHERE signal.variable_id IN (
-            SELECT variable_id FROM variable_ids
-        )
-    )
-    SELECT source.name from source
-    WHERE source.source_id IN (
-        SELECT source_id from source_ids
+    return query(
+        db_file, EXAMPLE_QUERY_2, query_args={"variable": variable}, shared=shared
     )
-    
-    """
 
-    return query(db_file, example_query)
+
+EXAMPLE_QUERY_3 = """
+
+SELECT
+    source.name,
+    MAX(signal.timestamp)
+FROM signal
+    INNER JOIN source ON signal.source_id = source.source_id
+    INNER JOIN source_type ON source.source_type_id = source_type.source_type_id
+WHERE source_type.name = :type
+GROUP BY source.name
+ORDER BY MAX(signal.timestamp) ASC;
+
+"""
 
 
-def example_query_3(db_file: str) -> pd.DataFrame:
+def example_query_3(db_file: str, shared: bool = True) -> pd.DataFrame:
     """Get the latest signal of all sources from type 'DS18B20'."""
 
     type = "DS18B20"
 
-    example_query = f"""
+    return query(db_file, EXAMPLE_QUERY_3, query_args={"type": type}, shared=shared)
 
+
+EXAMPLE_QUERY_4 = """
+
+WITH count_table AS (
     SELECT
-        source.name,
-        MAX(signal.timestamp)
+        COUNT(variable_id) as count,
+        variable_id,
+        source_id,
+        STRFTIME('%W', timestamp) as date_trunc
     FROM signal
-        INNER JOIN source ON signal.source_id = source.source_id
-        INNER JOIN source_type ON source.source_type_id = source_type.source_type_id
-    WHERE source_type.name = '{type}'
-    GROUP BY source.name
-    ORDER BY MAX(signal.timestamp) ASC;
-        
+    GROUP BY
+        STRFTIME('%W', timestamp),
+        variable_id,
+        source_id
+)
+SELECT
+    count_table.count AS value_count,
+    variable.name AS variable_name,
+    source.name AS source_name,
+    count_table.date_trunc AS date_trunc
+FROM count_table
+INNER JOIN variable ON variable.variable_id = count_table.variable_id
+INNER JOIN source ON source.source_id = count_table.source_id
+ORDER BY date_trunc DESC;
+
+"""
+
+
+def example_query_4(db_file: str, use_count_cube: bool = False) -> pd.DataFrame:
+    """Count the entries for all the weekly aggregated data within the database and group by source and variable.
+
+    With use_count_cube the weeks are summed up from the daily counts of the count
+    cube of the slice (see count_cube.py) instead of scanning signal.
     """
 
-    return query(db_file, example_query)
-
-
-def example_query_4(db_file: str) -> pd.DataFrame:
-    """Count the entries for all the weekly aggregated data within the database and group by source and variable."""
-
-    example_query = f"""
-    
-    WITH count_table AS (
-        SELECT
-            COUNT(variable_id) as count,
-            variable_id,
-            source_id,
-            STRFTIME('%W', timestamp) as date_trunc
-        FROM signal
-        GROUP BY
-            STRFTIME('%W', timestamp),
-            variable_id,
-            source_id
-    )
-    SELECT
-        count_table.count AS value_count,
-        variable.name AS variable_name,
-        source.name AS source_name,
-        count_table.date_trunc AS date_trunc
-    FROM count_table
-    INNER JOIN variable ON variable.variable_id = count_table.variable_id
-    INNER JOIN source ON source.source_id = count_table.source_id
-    ORDER BY date_trunc DESC;
-    
-    """
+    if use_count_cube:
+        daily = count_cube.read_cube(db_file, "D")
+        daily["date_trunc"] = pd.to_datetime(daily["date_trunc"]).dt.strftime("%W")
+        weekly = daily.groupby(
+            ["date_trunc", "variable_name", "source_name"], as_index=False
+        )["value_count"].sum()
+        return weekly[
+            ["value_count", "variable_name", "source_name", "date_trunc"]
+        ].sort_values("date_trunc", ascending=False, ignore_index=True)
 
-    return query(db_file, example_query)
+    return query(db_file, EXAMPLE_QUERY_4)
 
 
-def example_query_5(
-    db_file: pathlib.PosixPath, cl_file: pathlib.PosixPath
-) -> pd.DataFrame:
-    """All data from package A1."""
-
-    content_a1 = pd.read_csv(cl_file, sep=";")
-
-    filter_a1 = content_a1[content_a1["A1"] == 1]
-    source_names_a1 = filter_a1["source"].to_list()
+PACKAGES = ["A1", "A2", "A3", "A4"]
 
-    example_query = f"""
+PACKAGE_QUERY = """
 
     SELECT
         signal.timestamp,
@@ -191,110 +360,151 @@ def example_query_5(
         unit,
         variable.name,
         source_type.name,
-        source.name
+        source.name,
+        {package_columns}
     FROM signal
+        INNER JOIN temp.package_source ON signal.source_id = package_source.source_id
         INNER JOIN site ON signal.site_id = site.site_id
         INNER JOIN variable ON signal.variable_id = variable.variable_id
         INNER JOIN source ON signal.source_id = source.source_id
         INNER JOIN source_type ON source.source_type_id = source_type.source_type_id
-    WHERE source.name IN (?{",?" * (len(source_names_a1)-1)})
 
     """
 
-    return query(db_file, example_query, query_args=source_names_a1)
 
+def load_content_list(cl_file: pathlib.PosixPath) -> pd.DataFrame:
+    """Read the package membership of all sources (package_information.csv)."""
+    return pd.read_csv(cl_file, sep=";")
 
-def example_query_6(
-    db_file: pathlib.PosixPath, cl_file: pathlib.PosixPath
-) -> pd.DataFrame:
-    """All data from package A2."""
 
-    content_a2 = pd.read_csv(cl_file, sep=";")
+def _create_package_source(conn, content: pd.DataFrame, packages: list[str]) -> None:
+    # a source without a flag of a package is not a member of it
+    membership = content.groupby("source")[packages].max().fillna(0)
+    membership = membership[(membership == 1).any(axis=1)]
 
-    filter_a2 = content_a2[content_a2["A2"] == 1]
-    source_names_a2 = filter_a2["source"].to_list()
+    columns = ", ".join(f'"{p}" INTEGER' for p in packages)
+    conn.execute("DROP TABLE IF EXISTS temp.package_member")
+    conn.execute("DROP TABLE IF EXISTS temp.package_source")
+    conn.execute(f"CREATE TEMP TABLE package_member (name TEXT PRIMARY KEY, {columns})")
+    conn.execute(
+        f"CREATE TEMP TABLE package_source (source_id INTEGER PRIMARY KEY, {columns})"
+    )
+    conn.executemany(
+        f"INSERT INTO temp.package_member VALUES (?{', ?' * len(packages)})",
+        [(name, *map(int, flags)) for name, flags in membership.iterrows()],
+    )
+    selected = ", ".join(f'package_member."{p}"' for p in packages)
+    conn.execute(
+        f"""
+        INSERT INTO temp.package_source
+        SELECT source.source_id, {selected}
+        FROM temp.package_member
+            INNER JOIN source ON source.name = package_member.name
+        """
+    )
 
-    example_query = f"""
 
-    SELECT
-        signal.timestamp,
-        value,
-        unit,
-        variable.name,
-        source_type.name,
-        source.name
-    FROM signal
-        INNER JOIN site ON signal.site_id = site.site_id
-        INNER JOIN variable ON signal.variable_id = variable.variable_id
-        INNER JOIN source ON signal.source_id = source.source_id
-        INNER JOIN source_type ON source.source_type_id = source_type.source_type_id
-    WHERE source.name IN (?{",?" * (len(source_names_a2)-1)})
+def _iter_packages(conn, sql_query, chunksize):
+    try:
+        yield from query_chunked(conn, sql_query, chunksize=chunksize)
+    finally:
+        conn.close()
+
+
+def extract_packages(
+    db_file: pathlib.PosixPath,
+    content,
+    packages: list[str] = PACKAGES,
+    chunksize: int = None,
+) -> pd.DataFrame:
+    """All data of several packages, extracted in a single query.
+
+    The sources of the packages are resolved to their source_id in a temporary
+    table that signal is joined against, so the extraction scans signal once no
+    matter how many packages are requested.
+
+    Args:
+        db_file: Path to the data slice.
+        content: The content list as DataFrame (see load_content_list) or the
+            path to package_information.csv.
+        packages: The packages to extract, columns of the content list.
+        chunksize: If given, return an iterator over chunks (see query_chunked).
+
+    Returns:
+        The data with one 0/1 column per package telling whether the row belongs
+        to it.
 
     """
+    if not isinstance(content, pd.DataFrame):
+        content = load_content_list(content)
 
-    return query(db_file, example_query, query_args=source_names_a2)
+    unknown = set(packages).difference(content.columns)
+    if unknown:
+        raise ValueError(f"Unknown packages {sorted(unknown)}.")
 
+    # a connection of its own, temporary tables are not allowed on the shared
+    # query_only connections
+    conn = open_sqlite_readonly(db_file, query_only=False)
+    try:
+        try:
+            _create_package_source(conn, content, packages)
+        finally:
+            # the extraction itself runs query_only like on the shared connections
+            conn.execute("PRAGMA query_only = 1")
+    except BaseException:
+        conn.close()
+        raise
 
-def example_query_7(
-    db_file: pathlib.PosixPath, cl_file: pathlib.PosixPath
-) -> pd.DataFrame:
-    """All data from package A3."""
+    sql_query = PACKAGE_QUERY.format(
+        package_columns=", ".join(f'package_source."{p}"' for p in packages)
+    )
 
-    content_a3 = pd.read_csv(cl_file, sep=";")
+    if chunksize is not None:
+        return _iter_packages(conn, sql_query, chunksize)
 
-    filter_a3 = content_a3[content_a3["A3"] == 1]
-    source_names_a3 = filter_a3["source"].to_list()
+    try:
+        return _query_df(conn, sql_query, None)
+    finally:
+        conn.close()
 
-    example_query = f"""
 
-    SELECT
-        signal.timestamp,
-        value,
-        unit,
-        variable.name,
-        source_type.name,
-        source.name
-    FROM signal
-        INNER JOIN site ON signal.site_id = site.site_id
-        INNER JOIN variable ON signal.variable_id = variable.variable_id
-        INNER JOIN source ON signal.source_id = source.source_id
-        INNER JOIN source_type ON source.source_type_id = source_type.source_type_id
-    WHERE source.name IN (?{",?" * (len(source_names_a3)-1)})
+def _single_package(db_file, cl_file, package, chunksize):
+    data = extract_packages(db_file, cl_file, [package], chunksize=chunksize)
+    if chunksize is not None:
+        return (chunk.drop(columns=package) for chunk in data)
+    return data.drop(columns=package)
 
-    """
 
-    return query(db_file, example_query, query_args=source_names_a3)
+def example_query_5(
+    db_file: pathlib.PosixPath, cl_file: pathlib.PosixPath, chunksize: int = None
+) -> pd.DataFrame:
+    """All data from package A1, as iterator over chunks if chunksize is given."""
 
+    return _single_package(db_file, cl_file, "A1", chunksize)
 
-def example_query_8(
-    db_file: pathlib.PosixPath, cl_file: pathlib.PosixPath
+
+def example_query_6(
+    db_file: pathlib.PosixPath, cl_file: pathlib.PosixPath, chunksize: int = None
 ) -> pd.DataFrame:
-    """All data from package A4."""
+    """All data from package A2, as iterator over chunks if chunksize is given."""
 
-    content_a4 = pd.read_csv(cl_file, sep=";")
+    return _single_package(db_file, cl_file, "A2", chunksize)
 
-    filter_a4 = content_a4[content_a4["A4"] == 1]
-    source_names_a4 = filter_a4["source"].to_list()
 
-    example_query = f"""
+def example_query_7(
+    db_file: pathlib.PosixPath, cl_file: pathlib.PosixPath, chunksize: int = None
+) -> pd.DataFrame:
+    """All data from package A3, as iterator over chunks if chunksize is given."""
 
-    SELECT
-        signal.timestamp,
-        value,
-        unit,
-        variable.name,
-        source_type.name,
-        source.name
-    FROM signal
-        INNER JOIN site ON signal.site_id = site.site_id
-        INNER JOIN variable ON signal.variable_id = variable.variable_id
-        INNER JOIN source ON signal.source_id = source.source_id
-        INNER JOIN source_type ON source.source_type_id = source_type.source_type_id
-    WHERE source.name IN (?{",?" * (len(source_names_a4)-1)})
+    return _single_package(db_file, cl_file, "A3", chunksize)
 
-    """
 
-    return query(db_file, example_query, query_args=source_names_a4)
+def example_query_8(
+    db_file: pathlib.PosixPath, cl_file: pathlib.PosixPath, chunksize: int = None
+) -> pd.DataFrame:
+    """All data from package A4, as iterator over chunks if chunksize is given."""
+
+    return _single_package(db_file, cl_file, "A4", chunksize)
 
 
 def main(args: argparse.Namespace) -> None:
@@ -310,10 +520,12 @@ def main(args: argparse.Namespace) -> None:
     # print(example_query_2(db_file=db))
     # print(example_query_3(db_file=db))
     # print(example_query_4(db_file=db))
+    # print(example_query_4(db_file=db, use_count_cube=True))
     # print(example_query_5(db_file=db, cl_file=cl))
     # print(example_query_6(db_file=db, cl_file=cl))
     # print(example_query_7(db_file=db, cl_file=cl))
     # print(example_query_8(db_file=db, cl_file=cl))
+    # print(extract_packages(db_file=db, content=cl))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,122 @@
+# coding: utf-8
+
+
+"""Content-addressed cache of query results as Parquet files.
+
+A result is stored under the SHA-256 of the content of the queried slice files,
+the SQL text and the query parameters, so it is reused as long as neither the
+data nor the query change and never has to be invalidated by hand. Parquet keeps
+the dtypes, no dates or numbers are parsed again when a result is loaded.
+
+Hashing a slice reads the whole file, the digests are therefore remembered in
+<cache directory>/digests.json per path, size and modification time.
+
+"""
+
+
+import hashlib
+import json
+import pathlib
+
+import pandas as pd
+
+
+DIGEST_FILE = "digests.json"
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+class ResultCache:
+    """Query results of data slices stored in a directory.
+
+    The columns are stored by position and their names in a JSON file next to the
+    Parquet file, as results of joins often have duplicate column names (e.g. the
+    name of source and of variable), which Parquet does not support.
+
+    """
+
+    def __init__(self, directory: pathlib.Path):
+        self.directory = pathlib.Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._digests = None
+
+    def _load_digests(self) -> dict:
+        if self._digests is None:
+            file = self.directory / DIGEST_FILE
+            self._digests = json.loads(file.read_text()) if file.exists() else {}
+        return self._digests
+
+    def _save_digests(self) -> None:
+        tmp = self.directory / (DIGEST_FILE + ".tmp")
+        tmp.write_text(json.dumps(self._digests, indent=4, sort_keys=True))
+        tmp.replace(self.directory / DIGEST_FILE)
+
+    def file_digest(self, file: pathlib.Path) -> str:
+        """SHA-256 of the content of file, hashed only if the file changed."""
+        file = pathlib.Path(file).resolve()
+        stat = file.stat()
+        stamp = [stat.st_size, stat.st_mtime_ns]
+
+        digests = self._load_digests()
+        entry = digests.get(str(file))
+        if entry is not None and entry["stamp"] == stamp:
+            return entry["sha256"]
+
+        sha256 = hashlib.sha256()
+        with file.open("rb") as f:
+            for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
+                sha256.update(block)
+        digests[str(file)] = {"stamp": stamp, "sha256": sha256.hexdigest()}
+        self._save_digests()
+        return digests[str(file)]["sha256"]
+
+    def key(self, db_files, sql_query: str, query_args=None) -> str:
+        if isinstance(db_files, (str, pathlib.PurePath)):
+            db_files = [db_files]
+        content = {
+            "files": [self.file_digest(db) for db in db_files],
+            "sql": sql_query,
+            "params": query_args,
+        }
+        return hashlib.sha256(
+            json.dumps(content, sort_keys=True, default=str).encode()
+        ).hexdigest()
+
+    def load(self, key: str) -> pd.DataFrame:
+        """The cached result of key, None if there is none."""
+        file = self.directory / f"{key}.parquet"
+        if not file.exists():
+            return None
+        df = pd.read_parquet(file)
+        meta = json.loads((self.directory / f"{key}.json").read_text())
+        df.columns = meta["columns"]
+        return df
+
+    def store(self, key: str, df: pd.DataFrame) -> None:
+        meta = {"columns": [str(column) for column in df.columns]}
+        (self.directory / f"{key}.json").write_text(json.dumps(meta))
+
+        positional = df.set_axis([str(i) for i in range(df.shape[1])], axis=1)
+        tmp = self.directory / f"{key}.parquet.tmp"
+        positional.to_parquet(tmp)
+        tmp.replace(self.directory / f"{key}.parquet")
+
+    def get_or_run(
+        self, db_files, sql_query: str, query_args, run, refresh: bool = False
+    ) -> pd.DataFrame:
+        """The cached result of sql_query, computed by run() on a cache miss.
+
+        Args:
+            db_files: The slice file or files the result is computed from.
+            sql_query: The query text, part of the key.
+            query_args: The query parameters, part of the key.
+            run: Function without arguments returning the result.
+            refresh: Compute the result with run() and replace the cached one
+                even if there is one.
+
+        """
+        key = self.key(db_files, sql_query, query_args)
+        df = None if refresh else self.load(key)
+        if df is None:
+            df = run()
+            self.store(key, df)
+        return df
@@ -0,0 +1,162 @@
+# coding: utf-8
+
+
+"""Query several yearly data slices as one database.
+
+All slice files are attached read-only to a single in-memory connection. Temporary
+views UNION ALL the tables of the slices and add the slice year as column
+slice_year, so multi-year questions are answered by one query executed by SQLite:
+
+    signal        signal of all slices
+    source, variable, site, source_type
+                  the dimension tables of all slices, ids are only unique
+                  together with slice_year
+    signal_named  signal joined with its unit, variable, source and site names,
+                  site is NULL for signals without a site
+
+"""
+
+
+import argparse
+import contextlib as ctlib
+import pathlib
+import re
+import sqlite3
+
+import pandas as pd
+
+
+DIMENSION_TABLES = ["source", "variable", "site", "source_type"]
+
+# SQLite allows at most 10 attached databases by default
+MAX_SLICES = 10
+
+# the signal of the slice in {schema} joined with its names, the part of the view
+# signal_named of one slice
+SIGNAL_NAMED_SELECT = """
+SELECT
+    {year} AS slice_year,
+    signal.timestamp AS timestamp,
+    signal.value AS value,
+    variable.unit AS unit,
+    variable.name AS variable,
+    source.name AS source,
+    site.name AS site
+FROM {schema}.signal AS signal
+    INNER JOIN {schema}.variable AS variable
+        ON signal.variable_id = variable.variable_id
+    INNER JOIN {schema}.source AS source
+        ON signal.source_id = source.source_id
+    LEFT JOIN {schema}.site AS site
+        ON signal.site_id = site.site_id
+"""
+
+
+def slice_year(db_file: pathlib.Path) -> int:
+    """The first year of a slice file such as data_UWO_2019-01_2020-01.sqlite."""
+    match = re.search(r"(\d{4})-\d{2}_\d{4}-\d{2}", pathlib.Path(db_file).name)
+    if match is None:
+        raise ValueError(f"Can not derive the slice year of {db_file}.")
+    return int(match.group(1))
+
+
+def _union_view(name: str, selects: list[str]) -> str:
+    return f"CREATE TEMP VIEW {name} AS " + " UNION ALL ".join(selects)
+
+
+@ctlib.contextmanager
+def open_federation(db_files: list[pathlib.Path], years: list[int] = None):
+    """A connection with all slices attached and the federated views created.
+
+    Args:
+        db_files: The slice files.
+        years: The slice year of every file, derived from the file names if None.
+
+    """
+    if years is None:
+        years = [slice_year(db) for db in db_files]
+    if len(db_files) > MAX_SLICES:
+        raise ValueError(f"At most {MAX_SLICES} slices can be attached.")
+
+    conn = sqlite3.connect("file::memory:", uri=True)
+    try:
+        for db, year in zip(db_files, years):
+            uri = pathlib.Path(db).resolve().as_uri() + "?mode=ro"
+            conn.execute(f"ATTACH DATABASE ? AS slice_{year}", (uri,))
+
+        conn.execute(
+            _union_view(
+                "signal",
+                [f"SELECT {y} AS slice_year, * FROM slice_{y}.signal" for y in years],
+            )
+        )
+        for table in DIMENSION_TABLES:
+            conn.execute(
+                _union_view(
+                    table,
+                    [
+                        f"SELECT {y} AS slice_year, * FROM slice_{y}.{table}"
+                        for y in years
+                    ],
+                )
+            )
+        conn.execute(
+            _union_view(
+                "signal_named",
+                [
+                    SIGNAL_NAMED_SELECT.format(year=y, schema=f"slice_{y}")
+                    for y in years
+                ],
+            )
+        )
+        yield conn
+    finally:
+        conn.close()
+
+
+def query(
+    db_files: list[pathlib.Path],
+    sql_query: str,
+    query_args: list = None,
+    years: list[int] = None,
+) -> pd.DataFrame:
+    """Run one query against the federated views of all slices."""
+    with open_federation(db_files, years) as conn:
+        return pd.read_sql_query(sql_query, conn, params=query_args)
+
+
+def main(args: argparse.Namespace) -> None:
+    path_to_db = pathlib.Path(args.sourcedirectory)
+    dbs = [path_to_db / filename for filename in args.filenames]
+
+    print(
+        query(
+            dbs,
+            """
+            SELECT slice_year, COUNT(*) AS n_values, MIN(timestamp), MAX(timestamp)
+            FROM signal
+            GROUP BY slice_year
+            """,
+        )
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-sd", "--sourcedirectory", default="/path/to/db_file_directory"
+    )
+    parser.add_argument(
+        "-fn",
+        "--filenames",
+        nargs="+",
+        default=[
+            "data_UWO_2019-01_2020-01.sqlite",
+            "data_UWO_2020-01_2021-01.sqlite",
+            "data_UWO_2021-01_2022-01.sqlite",
+        ],
+    )
+
+    args = parser.parse_args()
+
+    main(args)
@@ -46,6 +46,23 @@ COMBINATIONS = [
     },
 ]
 
+# the values of a source and variable between two timestamps, compared with the datapool
+COMPARE_DATA_QUERY = """
+SELECT
+    signal.timestamp AS timestamp,
+    value AS value,
+    unit AS unit,
+    variable.name AS parameter,
+    source.name AS source
+FROM signal
+    INNER JOIN variable ON signal.variable_id = variable.variable_id
+    INNER JOIN source ON signal.source_id = source.source_id
+WHERE source.name = :source
+    AND variable.name = :variable
+    AND signal.timestamp >= :start_date
+    AND signal.timestamp <= :end_date
+"""
+
 
 @contextlib.contextmanager
 def open_sqlite(db_file):
@@ -59,11 +76,12 @@ def open_sqlite(db_file):
         conn.close()
 
 
-def query_sqlite(db_file: pathlib.PosixPath, sql_query: str):
+def query_sqlite(db_file: pathlib.PosixPath, sql_query: str, params: dict = None):
     with open_sqlite(db_file) as conn:
         return pd.read_sql_query(
             sql_query,
             conn,
+            params=params,
         )
 
 
@@ -78,23 +96,6 @@ def query_datapool(source, parameter, start, end):
 
 
 def compare_data(sqlite_path: pathlib.Path, selection: dict) -> None:
-    sql_query = f"""
-        SELECT
-        signal.timestamp AS timestamp,
-        value AS value,
-        unit AS unit,
-        variable.name AS parameter,
-        source.name AS source
-    FROM signal
-        INNER JOIN variable ON signal.variable_id = variable.variable_id
-        INNER JOIN source ON signal.source_id = source.source_id
-    WHERE source.name = '{selection.get("source")}'
-        AND variable.name = '{selection.get("parameter")}'
-        AND signal.timestamp >= '{selection.get("start")}'
-        AND signal.timestamp <= '{selection.get("end")}';   
-    
-    """
-
     data_datapool = query_datapool(
         selection.get("source"),
         selection.get("parameter"),
@@ -104,7 +105,16 @@ def compare_data(sqlite_path: pathlib.Path, selection: dict) -> None:
     data_datapool = data_datapool[["timestamp", "value", "unit", "parameter", "source"]]
     data_datapool = data_datapool.sort_values(by="parameter")
 
-    data_sqlite = query_sqlite(sqlite_path, sql_query)
+    data_sqlite = query_sqlite(
+        sqlite_path,
+        COMPARE_DATA_QUERY,
+        params={
+            "source": selection.get("source"),
+            "variable": selection.get("parameter"),
+            "start_date": selection.get("start"),
+            "end_date": selection.get("end"),
+        },
+    )
     data_sqlite = data_sqlite.sort_values(by="parameter")
 
     print(
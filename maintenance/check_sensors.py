@@ -1,20 +1,50 @@
 # -*- coding: utf-8 -*-
 
 
+import argparse
+import concurrent.futures as cf
 import datetime
 import json
+import queue
+import threading
+import time
 from pathlib import Path
 
 import numpy as np
 import pandas as pd
+import psycopg2
 import tqdm
 from datapool_client import DataPool
 from matplotlib import pyplot as plt
 from matplotlib.backends.backend_pdf import PdfPages
-from scipy import stats
 from scipy.stats import ks_2samp
 
-from . import helper_functions
+from . import datapool_registry, helper_functions, psr_detector, psr_history
+
+# errors of a signal check that only concern the checked sensor: the datapool request failed (datapool_client
+# uses psycopg2), the sensor is missing in the config or there is not enough data to compare the signals
+SIGNAL_CHECK_ERRORS = (psycopg2.Error, OSError, KeyError, ValueError)
+
+
+class SignalCache:
+    # '''
+    # Downsampled signals loaded from the datapool. A signal is only loaded once, also if several
+    # Check_Signal_Sensor use it (e.g. the same sensor is "similar_to" several sensors).
+    # '''
+    def __init__(self):
+        self._signals = {}
+
+    def get(self, source, parameter_name, start="2022-01-01", end=""):
+        key = (source, parameter_name, start, end)
+        if key not in self._signals:
+            dp = DataPool()
+            data_loaded = dp.signal.get(
+                source_name=source, start=start, end=end, parameter_name=parameter_name
+            )
+            self._signals[key] = helper_functions.downsample_data(
+                data_loaded, groupby_att="source"
+            )
+        return self._signals[key]
 
 
 class Check_Signal_Sensor:
@@ -78,7 +108,9 @@ class Check_Signal_Sensor:
     # get_dif_between2signals
     #     takes two signals, joins them on the same timestamp, standardizes them and takes the difference.
     # '''
-    def __init__(self, source_to_check, config_file):
+    def __init__(
+        self, source_to_check, config_file, signal_cache=None, config_data=None
+    ):
         # '''
         # Parameters
         # ----------
@@ -86,42 +118,47 @@ class Check_Signal_Sensor:
         #     source_name which signal should be checked
         # init_file : json
         #     json file containing the information which main parameter is used for the checking and also which sensor shows similiar sensor data
+        # signal_cache : SignalCache
+        #     signals that were already loaded, e.g. by the check of another sensor. A new one is used if None.
+        # config_data : dict
+        #     content of config_file if it was already loaded
         # '''
-        self.config_data = self.load_config_json(config_file)
+        if config_data is None:
+            config_data = self.load_config_json(config_file)
+        self.config_data = config_data
+        self.signal_cache = signal_cache if signal_cache is not None else SignalCache()
         self.source_to_check = source_to_check
         self.source_to_check_against = self.config_data[self.source_to_check][
             "similar_to"
         ]
-        print(self.source_to_check_against)
-        self.parameter_name = self_data[self.source_to_check]["main_parameter"]
+        self.parameter_name = self.config_data[self.source_to_check]["main_parameter"]
         (
             self._current_date,
             self._date1weekago,
             self._date4monthago,
         ) = self.get_current_and_date4monthago()
-        self.signal_to_check_current = self.load_signal(
-            self.source_to_check,
-            start=self._date1weekago,
-            end=self._current_date,
-            parameter_name=self.parameter_name,
-        )
-        self.signal_to_check_historic = self.load_signal(
-            self.source_to_check,
-            start=self._date4monthago,
-            end=self._date1weekago,
-            parameter_name=self.parameter_name,
-        )
-        self.signal_to_check_against_current = self.load_signal(
-            self.source_to_check_against,
-            start=self._date1weekago,
-            end=self._current_date,
-            parameter_name=self.parameter_name,
+        # the last 16 weeks of both signals are loaded once and split into the last week and the weeks before
+        (
+            self.signal_to_check_current,
+            self.signal_to_check_historic,
+        ) = self.split_current_and_historic(
+            self.load_signal(
+                self.source_to_check,
+                start=self._date4monthago,
+                end=self._current_date,
+                parameter_name=self.parameter_name,
+            )
         )
-        self.signal_to_check_against_historic = self.load_signal(
-            self.source_to_check_against,
-            start=self._date4monthago,
-            end=self._date1weekago,
-            parameter_name=self.parameter_name,
+        (
+            self.signal_to_check_against_current,
+            self.signal_to_check_against_historic,
+        ) = self.split_current_and_historic(
+            self.load_signal(
+                self.source_to_check_against,
+                start=self._date4monthago,
+                end=self._current_date,
+                parameter_name=self.parameter_name,
+            )
         )
         self.diff_historic_rel, self.diff_historic_abs = self.get_dif_between2signals(
             df1=self.signal_to_check_historic, df2=self.signal_to_check_against_historic
@@ -137,21 +174,20 @@ class Check_Signal_Sensor:
     yesterday = yesterday.strftime("%Y-%m-%d") + " 23:59:59"
 
     def load_signal(self, source, parameter_name, start="2022-01-01", end=""):
-        dp = DataPool()
-        if end != "":
-            data_loaded = dp.signal.get(
-                source_name=source, start=start, end=end, parameter_name=parameter_name
-            )
-        else:
-            data_loaded = dp.signal.get(
-                source_name=source, start=start, end=end, parameter_name=parameter_name
-            )
-        data_loaded = helper_functions.downsample_data(
-            data_loaded, groupby_att="source"
+        return self.signal_cache.get(source, parameter_name, start=start, end=end)
+
+    def split_current_and_historic(self, signal):
+        # splits a signal into the most recent week and the weeks before
+        # the boundary is a local date, in the timezone of the timestamps if they have one
+        boundary = pd.Timestamp(self._date1weekago)
+        if signal["timestamp"].dt.tz is not None:
+            boundary = boundary.tz_localize(signal["timestamp"].dt.tz)
+        current = signal["timestamp"] >= boundary
+        return (
+            signal[current].reset_index(drop=True),
+            signal[~current].reset_index(drop=True),
         )
 
-        return data_loaded
-
     def load_config_json(self, path_to_config):
         path = Path(path_to_config)
         file = open(path)
@@ -224,15 +260,57 @@ class Check_Signal_Sensor:
         return (dataToCompare["rel_difference"], dataToCompare["abs_difference"])
 
 
+def check_signals(config_file, signal_cache=None):
+    # '''
+    # checks the signal of every sensor in the config file. The config file is read once and the signals are shared
+    # between the checks, so that every signal is loaded once.
+
+    # Returns
+    # -------
+    # dict
+    #     the Check_Signal_Sensor per sensor, or the exception why the sensor could not be checked
+    # '''
+    with open(Path(config_file)) as file:
+        config_data = json.load(file)
+    if signal_cache is None:
+        signal_cache = SignalCache()
+    results = {}
+    for source in config_data:
+        try:
+            results[source] = Check_Signal_Sensor(
+                source,
+                config_file,
+                signal_cache=signal_cache,
+                config_data=config_data,
+            )
+        except SIGNAL_CHECK_ERRORS as error:
+            results[source] = error
+    return results
+
+
 class PSR_Sensor:
-    def __init__(self, source_name, start_date, end_date):
+    def __init__(
+        self, source_name, start_date, end_date, previous_PSR=None, history=None
+    ):
+        # previous_PSR: weekly PSR of the source that was already calculated, e.g. by
+        # helper_functions.calculate_PSR_batch. It is calculated here if None.
+        # history: psr_history.PSRHistory with the completed weeks of the source. If given and previous_PSR is
+        # None, only the weeks that are not stored are calculated (see weekly_PSR_with_history).
         self.old_mean = 0
         self.source_name = source_name
         self.loaded_data_since = start_date
         self.loaded_data_upto = end_date
-        self.previous_PSR = self.calculate_previous_weekly_PSR(
-            source_name=source_name, start_date=start_date, end_date=end_date
-        )
+        if previous_PSR is None and history is not None:
+            previous_PSR = weekly_PSR_with_history(
+                [source_name], start_date, end_date, history
+            )[source_name]
+        elif previous_PSR is None:
+            previous_PSR = self.calculate_previous_weekly_PSR(
+                source_name=source_name,
+                start_date=start_date,
+                end_date=end_date,
+            )
+        self.previous_PSR = previous_PSR
         self.data = self.previous_PSR
 
     def calculate_previous_weekly_PSR(self, source_name, start_date, end_date):
@@ -246,40 +324,307 @@ class PSR_Sensor:
         return previous_PSR
 
     def calculate_z_score_PSR(self):
-        psr_df = self.data
-
-        # replace inf values with nan
-        psr_df.replace([np.inf, -np.inf], np.nan, inplace=True)
-
-        # drop nan values
-        psr_df = psr_df.dropna()
+        # replace inf values with nan and drop nan values
+        psr_df = self.data.replace([np.inf, -np.inf], np.nan).dropna()
 
         # make two tables. First stores all psr of previous weeks, second one stores psr of current (last recorded ) week
         psr_previous = psr_df.iloc[0:-1]
-        psr_current = psr_df.iloc[-1]
-
-        # we drop the psr values of previous weeks if they were strong outliers
-        psr_previous["z_score"] = stats.zscore(psr_previous["normalized_count"])
-        psr_df_filtered = psr_previous[psr_previous["z_score"] > -3]
-
-        # calculate the mean value of PSR over the last couple of weeks (disregarding the current week) and update variable
-        self.old_mean = np.mean(psr_df_filtered["normalized_count"])
+        psr_current = psr_df.iloc[-1:]
+        current_PSR = psr_current["normalized_count"].iloc[0]
+
+        # we drop the psr values of previous weeks if they were strong outliers, the detector keeps the mean and
+        # variance of the remaining ones
+        accepted = psr_detector.not_outliers(psr_previous["normalized_count"])
+        self.detector = psr_detector.PSRDropDetector.from_history(
+            psr_previous["normalized_count"]
+        )
 
-        # now add the current week to the table again
-        # psr_df_filtered=pd.concat([psr_df_filtered,psr_current])
-        psr_df_filtered = psr_df_filtered.append(psr_current)
+        # the mean value of PSR over the last couple of weeks (disregarding the current week)
+        self.old_mean = self.detector.mean
 
-        # calculate the z score
-        psr_df_filtered["z_score"] = stats.zscore(psr_df_filtered["normalized_count"])
+        # calculate the z score of the current week among the previous weeks and the current week
+        z_score, self.is_suspicious = self.detector.evaluate(current_PSR)
+        mean, std = self.detector.statistics_with(current_PSR)
+        psr_df_filtered = pd.concat([psr_previous[accepted], psr_current])
+        psr_df_filtered["z_score"] = (
+            (psr_df_filtered["normalized_count"] - mean) / std if std > 0 else np.nan
+        )
+        psr_df_filtered.iloc[-1, psr_df_filtered.columns.get_loc("z_score")] = z_score
         self.data = psr_df_filtered
         return psr_df_filtered
 
 
+def weekly_PSR_with_history(sensors, start_date, end_date, history):
+    # the weekly PSR per sensor since start_date, completed from the history (see psr_history.PSRHistory.update).
+    # Only the weeks that are not stored are calculated, with the main parameter and most common timedelta stored
+    # for the sensor, so that stored and new weeks are calculated alike. The sensors are calculated in groups with
+    # the same plan, so that a sensor without history does not make the others calculate all weeks again.
+    plan = history.plan(sensors, start_date)
+    groups = {}
+    for sensor, (fetch_start, basis) in plan.items():
+        groups.setdefault((fetch_start, basis is None), []).append(sensor)
+
+    weekly_PSR = {}
+    for (fetch_start, full), group in groups.items():
+        basis = None
+        if not full:
+            basis = pd.DataFrame.from_dict(
+                {sensor: plan[sensor][1] for sensor in group}, orient="index"
+            )[psr_history.BASIS_COLUMNS]
+        PSR, used_basis = helper_functions.calculate_PSR_batch(
+            start_date=fetch_start.strftime(psr_history.TIMESTAMP_FORMAT),
+            end_date=end_date,
+            resolution="W",
+            allow_higher_samplingrates=False,
+            source_names=group,
+            basis=basis,
+            return_basis=True,
+        )
+        for sensor in group:
+            new_basis = None
+            if full and sensor in used_basis.index:
+                new_basis = used_basis.loc[sensor]
+            weekly_PSR[sensor] = history.update(
+                sensor,
+                PSR,
+                start_date=start_date,
+                end_date=end_date,
+                fetch_start=fetch_start,
+                basis=new_basis,
+            )
+    return weekly_PSR
+
+
+def _check_PSR_of_chunk(sensors, start_date, end_date, history=None):
+    # the weekly PSR of the sensors at once, the result is the checked PSR_Sensor
+    # or the exception that occured per sensor. With a history only the weeks that are not stored are calculated.
+    if history is not None:
+        weekly_PSR = weekly_PSR_with_history(sensors, start_date, end_date, history)
+    else:
+        weekly_PSR = helper_functions.calculate_PSR_batch(
+            start_date=start_date,
+            end_date=end_date,
+            resolution="W",
+            allow_higher_samplingrates=False,
+            source_names=list(sensors),
+        )
+        weekly_PSR = {
+            sensor: PSR.reset_index(drop=True)
+            for sensor, PSR in weekly_PSR.groupby("sensor")
+        }
+    results = {}
+    for sensor in sensors:
+        try:
+            if sensor not in weekly_PSR:
+                raise ValueError(f"could not calculate the PSR of {sensor}")
+            sensor_to_check = PSR_Sensor(
+                sensor,
+                start_date=start_date,
+                end_date=end_date,
+                previous_PSR=weekly_PSR[sensor],
+            )
+            if sensor_to_check.data.empty:
+                raise ValueError(f"could not calculate the PSR of {sensor}")
+            sensor_to_check.calculate_z_score_PSR()
+            results[sensor] = sensor_to_check
+        except Exception as error:
+            results[sensor] = error
+    return results
+
+
+def check_PSR_of_sensors(
+    sensors,
+    start_date,
+    end_date,
+    max_workers=4,
+    chunk_size=25,
+    timeout=900,
+    history=None,
+):
+    # '''
+    # calculates the weekly PSR and its z score of all sensors in parallel. The sensors are split into chunks
+    # of chunk_size, the PSR of a chunk is loaded by one query (see helper_functions.calculate_PSR_batch).
+    # The chunks are run by at most max_workers threads, as the work is mostly waiting for the datapool.
+
+    # Parameters
+    # ----------
+    # sensors : list
+    #     names of the sensors to check
+    # start_date : str
+    #     first date of the PSR
+    # end_date : str
+    #     last date of the PSR
+    # max_workers : int
+    #     number of chunks that are processed at the same time
+    # chunk_size : int
+    #     number of sensors per chunk
+    # timeout : float
+    #     seconds after which a running chunk is given up and its sensors are reported as failed. A thread
+    #     cannot be stopped, so the chunk keeps running in the background and its result is ignored. The
+    #     threads are daemon threads, a chunk that hangs does not keep the program from exiting.
+    # history : psr_history.PSRHistory
+    #     stored weekly PSR. If given, only the weeks after the stored ones are calculated.
+
+    # Returns
+    # -------
+    # dict
+    #     the checked PSR_Sensor per sensor, or the exception why the sensor could not be checked.
+    #     A failing sensor or chunk does not affect the other ones.
+    # '''
+    if max_workers < 1:
+        raise ValueError(f"max_workers must be at least 1, got {max_workers}")
+    if chunk_size < 1:
+        raise ValueError(f"chunk_size must be at least 1, got {chunk_size}")
+    chunks = [sensors[i : i + chunk_size] for i in range(0, len(sensors), chunk_size)]
+    futures = [cf.Future() for _ in chunks]
+    tasks = queue.SimpleQueue()
+    for i in range(len(chunks)):
+        tasks.put(i)
+    started = {}
+
+    def work():
+        # unlike the workers of cf.ThreadPoolExecutor, which are joined at exit, these are daemon threads
+        while True:
+            try:
+                i = tasks.get_nowait()
+            except queue.Empty:
+                return
+            if not futures[i].set_running_or_notify_cancel():
+                continue
+            started[i] = time.monotonic()
+            try:
+                futures[i].set_result(
+                    _check_PSR_of_chunk(chunks[i], start_date, end_date, history)
+                )
+            except Exception as error:
+                futures[i].set_exception(error)
+
+    for _ in range(min(max_workers, len(chunks))):
+        threading.Thread(target=work, daemon=True).start()
+
+    results = {}
+    try:
+        pending = {future: i for i, future in enumerate(futures)}
+        with tqdm.tqdm(total=len(sensors)) as progress:
+            while pending:
+                done, _ = cf.wait(pending, timeout=1, return_when=cf.FIRST_COMPLETED)
+                now = time.monotonic()
+                for future, i in list(pending.items()):
+                    if future in done:
+                        try:
+                            results.update(future.result())
+                        except Exception as error:
+                            results.update({sensor: error for sensor in chunks[i]})
+                    elif i in started and now - started[i] > timeout:
+                        error = TimeoutError(
+                            f"calculating the PSR took longer than {timeout} s"
+                        )
+                        results.update({sensor: error for sensor in chunks[i]})
+                    else:
+                        continue
+                    del pending[future]
+                    progress.update(len(chunks[i]))
+    finally:
+        # chunks that did not start yet are not started anymore
+        for future in futures:
+            future.cancel()
+    return results
+
+
+class SensorCheckResults:
+    # '''
+    # Collects the results of the PSR check. The rows are only appended while checking, the tables are built,
+    # sorted and rounded once when they are requested.
+
+    # Attributes
+    # ----------
+    # suspicious : pandas DataFrame
+    #     sensors whose PSR is suspicious
+    # unsuspicious : pandas DataFrame
+    #     sensors whose PSR is not suspicious
+    # skipped : pandas DataFrame
+    #     sensors that could not be checked
+    # '''
+    COLUMNS = [
+        "source_name",
+        "last_recorded_PSR",
+        "mean of last 4 months",
+        "Last weeks PSR",
+        "z_score",
+    ]
+
+    def __init__(self):
+        self._suspicious = []
+        self._unsuspicious = []
+        self._skipped = []
+
+    def add(self, sensor_to_check, suspicious):
+        # '''
+        # Parameters
+        # ----------
+        # sensor_to_check : PSR_Sensor
+        #     sensor whose z score is calculated
+        # suspicious : bool
+        #     wheter or not the current PSR is suspicious
+        # '''
+        last_week = sensor_to_check.data.iloc[-1]
+        record = [
+            sensor_to_check.source_name,
+            str(last_week["timestamp"])[0:10],
+            sensor_to_check.old_mean,
+            last_week["normalized_count"],
+            last_week["z_score"],
+        ]
+        if suspicious:
+            self._suspicious.append(record)
+        else:
+            self._unsuspicious.append(record)
+
+    def add_skipped(self, source_name):
+        self._skipped.append([source_name])
+
+    def _table(self, records):
+        table = pd.DataFrame(records, columns=self.COLUMNS)
+        table = table.sort_values(
+            ["last_recorded_PSR", "Last weeks PSR"], ascending=[False, False]
+        ).reset_index(drop=True)
+        return table.round(3)
+
+    @property
+    def suspicious(self):
+        return self._table(self._suspicious)
+
+    @property
+    def unsuspicious(self):
+        return self._table(self._unsuspicious)
+
+    @property
+    def skipped(self):
+        return pd.DataFrame(self._skipped, columns=["source_name"])
+
+
 class Sensor_Report(PdfPages):
     def __init__(self, filename):
         self.current_page = 0
         super().__init__(filename=filename)
 
+    def add_check_results(self, check_results):
+        # '''
+        # adds the tables of a SensorCheckResults to the report
+        # '''
+        self.df_to_pdf(
+            check_results.suspicious,
+            "Sensors which PSR are suspicious:\nPSR is more than 2 standard deviation lower\nthan mean over last 16 weeks",
+        )
+        self.df_to_pdf(
+            check_results.unsuspicious,
+            "Sensors which PSR are not suspicious:\nPSR is less than 2 standard deviation lower\nthan mean over last 16 weeks",
+        )
+        self.df_to_pdf(
+            check_results.skipped,
+            "Skipped Sensors:\nProbably because no measurements during\nlast 4 months",
+        )
+
     def df_to_pdf(self, df, table_info):
         # '''
         # converts df into matplotlib table which can than be converted into a pdf
@@ -331,8 +676,7 @@ class Sensor_Report(PdfPages):
             self.current_page = page_number
 
 
-def main():
-    dp = DataPool()
+def main(args: argparse.Namespace) -> None:
     # loop thorugh sensors that sent signal the previous month:
     today = datetime.date.today()
     # To get a good estimate of this weeks psr, we include all data until the previous day until 23:59:59
@@ -343,118 +687,31 @@ def main():
     last_4month = today - datetime.timedelta(weeks=16)
     last_4month = last_4month.strftime("%Y-%m-%d")
 
-    # we make three different tables:
-    skipped_sensors = pd.DataFrame(columns=["source_name"])
-    suspicious_sensors = pd.DataFrame(
-        columns=[
-            "source_name",
-            "last_recorded_PSR",
-            "mean of last 4 months",
-            "Last weeks PSR",
-            "z_score",
-        ]
+    sensors = list(dict.fromkeys(datapool_registry.REGISTRY.source_names()))
+    results = check_PSR_of_sensors(
+        sensors,
+        start_date=last_4month,
+        end_date=yesterday,
+        max_workers=args.workers,
+        chunk_size=args.chunksize,
+        timeout=args.timeout,
+        history=psr_history.PSRHistory(args.historyfile) if args.historyfile else None,
     )
-    unsuspicious_sensors = pd.DataFrame(
-        columns=[
-            "source_name",
-            "last_recorded_PSR",
-            "mean of last 4 months",
-            "Last weeks PSR",
-            "z_score",
-        ]
-    )
-    counter = 0
-    for sensor in tqdm.tqdm(dp.source.all()["name"].unique()):
-        counter = counter + 1
-        if counter < 10:
-            try:
-                sensor_to_check = PSR_Sensor(
-                    sensor, start_date=last_4month, end_date=yesterday
-                )
-                sensor_to_check.calculate_z_score_PSR()
-                # make decision wheter or not current PSR is suspicious
-                if sensor_to_check.data.iloc[-1]["z_score"] < -2:
-                    suspicious_sensor = pd.DataFrame(
-                        columns=[
-                            "source_name",
-                            "last_recorded_PSR",
-                            "mean of last 4 months",
-                            "Last weeks PSR",
-                            "z_score",
-                        ],
-                        data=[
-                            [
-                                sensor,
-                                str(sensor_to_check.data.iloc[-1]["timestamp"])[0:10],
-                                sensor_to_check.old_mean,
-                                sensor_to_check.data.iloc[-1]["normalized_count"],
-                                sensor_to_check.data.iloc[-1]["z_score"],
-                            ]
-                        ],
-                    )
-                    suspicious_sensors = pd.concat(
-                        [suspicious_sensors, suspicious_sensor]
-                    )
-                else:
-                    unsuspicious_sensor = pd.DataFrame(
-                        columns=[
-                            "source_name",
-                            "last_recorded_PSR",
-                            "mean of last 4 months",
-                            "Last weeks PSR",
-                            "z_score",
-                        ],
-                        data=[
-                            [
-                                sensor,
-                                str(sensor_to_check.data.iloc[-1]["timestamp"])[0:10],
-                                sensor_to_check.old_mean,
-                                sensor_to_check.data.iloc[-1]["normalized_count"],
-                                sensor_to_check.data.iloc[-1]["z_score"],
-                            ]
-                        ],
-                    )
-                    unsuspicious_sensors = pd.concat(
-                        [unsuspicious_sensors, unsuspicious_sensor]
-                    )
+    check_results = SensorCheckResults()
+    for sensor in sensors:
+        try:
+            sensor_to_check = results[sensor]
+            if isinstance(sensor_to_check, Exception):
+                raise sensor_to_check
+            # make decision wheter or not current PSR is suspicious
+            check_results.add(sensor_to_check, suspicious=sensor_to_check.is_suspicious)
+        except Exception as error:
+            print(error)
+            check_results.add_skipped(sensor)
 
-            except Exception as error:
-                print(error)
-                skipped_sensor = pd.DataFrame(columns=["source_name"], data=[sensor])
-                skipped_sensors = pd.concat([skipped_sensors, skipped_sensor])
-
-            suspicious_sensors = (
-                suspicious_sensors.sort_values(
-                    ["last_recorded_PSR", "Last weeks PSR"], ascending=[False, False]
-                )
-                .reset_index()
-                .drop(columns="index")
-            )
-            suspicious_sensors = suspicious_sensors.round(3)
-            unsuspicious_sensors = (
-                unsuspicious_sensors.sort_values(
-                    ["last_recorded_PSR", "Last weeks PSR"], ascending=[False, False]
-                )
-                .reset_index()
-                .drop(columns="index")
-            )
-            unsuspicious_sensors = unsuspicious_sensors.round(3)
-        else:
-            break
     # make the report
     pp = Sensor_Report(f"PSR_Report_{today}.pdf")
-    pp.df_to_pdf(
-        suspicious_sensors,
-        "Sensors which PSR are suspicious:\nPSR is more than 2 standard deviation lower\nthan mean over last 16 weeks",
-    )
-    pp.df_to_pdf(
-        unsuspicious_sensors,
-        "Sensors which PSR are not suspicious:\nPSR is less than 2 standard deviation lower\nthan mean over last 16 weeks",
-    )
-    pp.df_to_pdf(
-        skipped_sensors,
-        "Skipped Sensors:\nProbably because no measurements during\nlast 4 months",
-    )
+    pp.add_check_results(check_results)
     pp.close()
 
     # '''
@@ -466,14 +723,46 @@ def main():
     #         information for this specific sensor, it is the only one that currently "works".):
 
     #             #do this for all important sensors! (To check whats happenign, go to the Check_Signal_Sensor class)
-    #             signal_to_check = Check_Signal_Sensor(source_to_check='bt_dl917_162_luppmenweg')
+    #             signal_to_check = Check_Signal_Sensor(source_to_check='bt_dl917_162_luppmenweg', config_file='config_concept.json')
     #             if (signal_to_check.ks_test[0] < 0.2) and (signal_to_check.ks_test[1] )<0.05:  #The two thresholds have to be defined!
     #                 print(f'{signal_to_check.source_to_check} is suspicious! Its difference to {signal_to_check_against} is significantly\n different to what it used to be (over the last 4 month))
     #             else:
     #                 print(f'{signal_to_check.source_to_check} is not suspicious!)
+    #         check_signals(config_file) does the check for all sensors in the config file and loads every signal only once.
     #     3. Instead of printing these statements, put the calcuated statistics in a report similar to the PSR test!
     # '''
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-w", "--workers", type=int, default=4, help="number of parallel tasks"
+    )
+    parser.add_argument(
+        "-cs",
+        "--chunksize",
+        type=int,
+        default=25,
+        help="number of sensors whose PSR is calculated by one task",
+    )
+    parser.add_argument(
+        "-t",
+        "--timeout",
+        type=float,
+        default=900,
+        help="seconds after which a running task is given up, its sensors are skipped",
+    )
+    parser.add_argument(
+        "-hf",
+        "--historyfile",
+        default="PSR_history.sqlite",
+        help="SQLite file that stores the weekly PSR of completed weeks, no history is used if empty",
+    )
+
+    args = parser.parse_args()
+    if args.workers < 1:
+        parser.error("the number of workers must be at least 1")
+    if args.chunksize < 1:
+        parser.error("the chunk size must be at least 1")
+
+    main(args)
@@ -0,0 +1,141 @@
+"""
+Process-wide registry of the datapool metadata (sources and parameters).
+
+The metadata changes rarely, but helper functions used to request it from the datapool on every call,
+often inside loops over all sources. The registry loads it once, refreshes it when it is older than
+its time to live and can keep a snapshot on disk, so that further processes start without a request.
+"""
+import os
+import pickle
+import threading
+import time
+
+from datapool_client import DataPool
+
+
+MAIN_PARAMETER_PREFIX = "Main measurement parameter"
+
+# one hour
+DEFAULT_TTL = 60 * 60
+
+
+class MetadataRegistry:
+    """
+    Cached sources and parameters of the datapool.
+
+    Parameters
+    ----------
+    ttl : float
+        seconds after which the metadata is loaded again
+    snapshot_file : str
+        pickle file to store the metadata in and to load it from while it is younger than ttl.
+        No snapshot is used if empty.
+    """
+
+    def __init__(self, ttl=DEFAULT_TTL, snapshot_file=""):
+        self.ttl = ttl
+        self.snapshot_file = snapshot_file
+        self._lock = threading.Lock()
+        self._loaded_at = None
+        self._sources = None
+        self._parameters = None
+        self._main_parameters = None
+        self._groups = None
+
+    def _is_stale(self):
+        return self._loaded_at is None or time.time() - self._loaded_at > self.ttl
+
+    def _load_snapshot(self):
+        if not self.snapshot_file or not os.path.exists(self.snapshot_file):
+            return False
+        with open(self.snapshot_file, "rb") as f:
+            snapshot = pickle.load(f)
+        if time.time() - snapshot["loaded_at"] > self.ttl:
+            return False
+        self._set(snapshot["sources"], snapshot["parameters"], snapshot["loaded_at"])
+        return True
+
+    def _save_snapshot(self):
+        tmp = self.snapshot_file + ".tmp"
+        with open(tmp, "wb") as f:
+            pickle.dump(
+                {
+                    "loaded_at": self._loaded_at,
+                    "sources": self._sources,
+                    "parameters": self._parameters,
+                },
+                f,
+            )
+        os.replace(tmp, self.snapshot_file)
+
+    def _set(self, sources, parameters, loaded_at):
+        self._sources = sources
+        self._parameters = parameters
+        main = (
+            parameters["description"].fillna("").str.startswith(MAIN_PARAMETER_PREFIX)
+        )
+        self._main_parameters = frozenset(parameters.loc[main, "name"])
+        groups = {}
+        for name in sources["name"]:
+            groups.setdefault(name.split("_")[0], []).append(name)
+        self._groups = groups
+        self._loaded_at = loaded_at
+
+    def refresh(self):
+        """
+        load the metadata from the datapool, regardless of its age
+        """
+        with self._lock:
+            dp = DataPool(to_replace={"parameter": "variable"})
+            self._set(dp.source.all(), dp.parameter.all(), time.time())
+            if self.snapshot_file:
+                self._save_snapshot()
+
+    def _ensure_loaded(self):
+        if not self._is_stale():
+            return
+        with self._lock:
+            if self._is_stale() and self._load_snapshot():
+                return
+        if self._is_stale():
+            self.refresh()
+
+    def sources(self):
+        """
+        all sources as returned by DataPool.source.all()
+        """
+        self._ensure_loaded()
+        return self._sources
+
+    def source_names(self):
+        """
+        the names of all sources, in the order of DataPool.source.all()
+        """
+        return list(self.sources()["name"])
+
+    def parameters(self):
+        """
+        all parameters as returned by DataPool.parameter.all()
+        """
+        self._ensure_loaded()
+        return self._parameters
+
+    def main_parameters(self):
+        """
+        the names of the main measurement parameters
+        """
+        self._ensure_loaded()
+        return self._main_parameters
+
+    def groups(self):
+        """
+        the names of the sources per group (the prefix of the source name, e.g. bt, bl, ...),
+        in the order the groups first appear among the sources
+        """
+        self._ensure_loaded()
+        return self._groups
+
+
+REGISTRY = MetadataRegistry(
+    snapshot_file=os.environ.get("DATAPOOL_METADATA_SNAPSHOT", "")
+)
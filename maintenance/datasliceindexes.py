@@ -0,0 +1,278 @@
+# coding: utf-8
+
+
+import logging
+import argparse
+import pathlib
+import re
+import shutil
+import sqlite3
+import tempfile
+import time
+import contextlib as ctlib
+
+from dataaccess import count_cube, example_queries, slice_federation
+from fieldobservations import check_sqlite_consistency
+
+from . import datasliceconsistency
+
+
+# candidate indexes for the filters of the project's queries on signal, only those
+# that remove a full table scan from the plan of a known query without adding one
+# are created
+INDEXES = {
+    "idx_signal_source_variable_timestamp": "signal (source_id, variable_id, timestamp, value)",
+    "idx_signal_site_timestamp": "signal (site_id, timestamp)",
+    "idx_source_name": "source (name)",
+    "idx_variable_name": "variable (name)",
+    "idx_site_name": "site (name)",
+}
+
+# the queries of example_queries.py and of the project's own checks on signal, on
+# one slice, with the parameters of query_parameters
+KNOWN_QUERIES = {
+    "example_query_1": example_queries.EXAMPLE_QUERY_1,
+    "example_query_2": example_queries.EXAMPLE_QUERY_2,
+    "example_query_3": example_queries.EXAMPLE_QUERY_3,
+    "example_query_4": example_queries.EXAMPLE_QUERY_4,
+    "slice_totals": "WITH signal_named AS ({}) {}".format(
+        slice_federation.SIGNAL_NAMED_SELECT.format(year=0, schema="main"),
+        datasliceconsistency.SLICE_TOTALS_QUERY,
+    ),
+    "compare_data": check_sqlite_consistency.COMPARE_DATA_QUERY,
+    "heatmap_counts": count_cube.DAILY_COUNTS_SELECT.format(schema="main"),
+}
+
+# number of signals of the sample on which the indexes are selected
+SAMPLE_SIZE = 100_000
+
+# a step of EXPLAIN QUERY PLAN that reads a whole table or one of its indexes, e.g.
+# "SCAN signal", "SCAN TABLE signal AS s" or "SCAN signal USING COVERING INDEX i"
+FULL_SCAN = re.compile(
+    r"SCAN (?:TABLE )?(\w+)(?: AS \w+)?(?: USING (?:COVERING )?INDEX \w+)?$"
+)
+
+
+@ctlib.contextmanager
+def open_sqlite(db_file, read_only=False):
+    if read_only:
+        conn = sqlite3.connect(
+            pathlib.Path(db_file).resolve().as_uri() + "?mode=ro", uri=True
+        )
+    else:
+        conn = sqlite3.connect(db_file)
+    try:
+        yield conn
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+def query_parameters(conn) -> dict:
+    """Take the parameters of the known queries from the first row of signal."""
+    location, source, variable, type, start = conn.execute(
+        """
+        SELECT site.name, source.name, variable.name, source_type.name, signal.timestamp
+        FROM (SELECT * FROM signal LIMIT 1) AS signal
+            INNER JOIN site ON signal.site_id = site.site_id
+            INNER JOIN variable ON signal.variable_id = variable.variable_id
+            INNER JOIN source ON signal.source_id = source.source_id
+            INNER JOIN source_type ON source.source_type_id = source_type.source_type_id
+        """
+    ).fetchone()
+    end = conn.execute("SELECT datetime(?, '+7 days')", (start,)).fetchone()[0]
+    last_id = conn.execute("SELECT MAX(signal_id) FROM signal").fetchone()[0]
+    return {
+        "location": location,
+        "source": source,
+        "variable": variable,
+        "type": type,
+        "start_date": start,
+        "end_date": end,
+        "watermark": 0,
+        "last_id": last_id,
+    }
+
+
+def explain(conn, sql_query: str, parameters: dict) -> str:
+    plan = conn.execute("EXPLAIN QUERY PLAN " + sql_query, parameters).fetchall()
+    return " | ".join(row[-1] for row in plan)
+
+
+def timed(conn, sql_query: str, parameters: dict, repeat: int = 2) -> float:
+    """Best of repeat runs, so that both sides are timed with a warm cache."""
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        conn.execute(sql_query, parameters).fetchall()
+        seconds.append(time.perf_counter() - start)
+    return min(seconds)
+
+
+def profile(conn, parameters: dict) -> dict:
+    return {
+        name: (explain(conn, sql_query, parameters), timed(conn, sql_query, parameters))
+        for name, sql_query in KNOWN_QUERIES.items()
+    }
+
+
+def full_scans(conn, parameters: dict) -> set:
+    """The (query, table) pairs of the known queries whose plan reads a whole table.
+    Scans of subqueries and common table expressions are left out."""
+    tables = {
+        name
+        for (name,) in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table'"
+        )
+    }
+    scans = set()
+    for name, sql_query in KNOWN_QUERIES.items():
+        plan = conn.execute("EXPLAIN QUERY PLAN " + sql_query, parameters).fetchall()
+        for row in plan:
+            match = FULL_SCAN.match(row[-1])
+            if match and match.group(1) in tables:
+                scans.add((name, match.group(1)))
+    return scans
+
+
+def scanned_rows(conn, scans: set) -> int:
+    """The number of rows read by the full scans, the cost of the scans."""
+    return sum(
+        conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+        for _, table in scans
+    )
+
+
+def copy_sample(conn, sample_file: pathlib.Path) -> None:
+    """Copy the schema, the dimension tables and about SAMPLE_SIZE signals of the slice
+    of conn to sample_file and analyze it, so that the planner has statistics of the
+    slice when the indexes are selected."""
+    db_file = conn.execute("PRAGMA database_list").fetchone()[2]
+    last_id = conn.execute("SELECT MAX(signal_id) FROM signal").fetchone()[0] or 0
+    step = max(1, last_id // SAMPLE_SIZE)
+    with open_sqlite(sample_file) as sample:
+        for (sql,) in conn.execute(
+            "SELECT sql FROM sqlite_master"
+            " WHERE sql IS NOT NULL AND name NOT LIKE 'sqlite_%'"
+        ):
+            sample.execute(sql)
+        uri = pathlib.Path(db_file).resolve().as_uri() + "?mode=ro"
+        sample.execute("ATTACH DATABASE ? AS slice", (uri,))
+        for table in slice_federation.DIMENSION_TABLES:
+            sample.execute(f"INSERT INTO {table} SELECT * FROM slice.{table}")
+        # every step-th signal, so that the sample covers the whole slice
+        sample.execute(
+            "INSERT INTO signal SELECT * FROM slice.signal WHERE signal_id % ? = 0",
+            (step,),
+        )
+        sample.commit()
+        sample.execute("DETACH DATABASE slice")
+        sample.execute("ANALYZE")
+        sample.commit()
+
+
+def select_indexes(conn, parameters: dict) -> list:
+    """The indexes of INDEXES that remove a full table scan from a known query.
+
+    The indexes are tried one after the other on an analyzed sample of the slice of
+    conn (see copy_sample), so that the slice is neither changed nor indexed in vain.
+    An index is kept if the known queries are left with a part of the full scans
+    before and no new one, or if their full scans read fewer rows. The indexes that
+    are not kept are tried again once others were kept, until none is kept anymore.
+
+    """
+    with tempfile.TemporaryDirectory() as sample_dir:
+        sample_file = pathlib.Path(sample_dir) / "sample.sqlite"
+        copy_sample(conn, sample_file)
+        with open_sqlite(sample_file) as sample:
+            selected = []
+            candidates = list(INDEXES)
+            scans = full_scans(sample, parameters)
+            kept = True
+            while kept:
+                kept = False
+                for name in list(candidates):
+                    sample.execute(f"CREATE INDEX {name} ON {INDEXES[name]}")
+                    sample.execute(f"ANALYZE {name}")
+                    remaining = full_scans(sample, parameters)
+                    removed, added = scans - remaining, remaining - scans
+                    if remaining < scans or scanned_rows(
+                        sample, remaining
+                    ) < scanned_rows(sample, scans):
+                        logging.info(
+                            f"Index {name} removes the full scans {sorted(removed)}"
+                            f" and adds {sorted(added)}."
+                        )
+                        selected.append(name)
+                        candidates.remove(name)
+                        scans = remaining
+                        kept = True
+                    else:
+                        logging.debug(
+                            f"Index {name} removes the full scans {sorted(removed)}"
+                            f" but adds {sorted(added)}."
+                        )
+                        sample.execute(f"DROP INDEX {name}")
+                        sample.execute("ANALYZE sqlite_master")
+            for name in candidates:
+                logging.info(f"Index {name} removes no full scan, it is not created.")
+            return selected
+
+
+def create_indexes(conn, names: list) -> None:
+    for name in names:
+        definition = INDEXES[name]
+        logging.info(f"Creating index {name} on {definition}.")
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {definition}")
+    conn.execute("ANALYZE")
+    conn.commit()
+
+
+def main(args: argparse.Namespace) -> None:
+    db = pathlib.Path(args.sourcedirectory) / args.filename
+    working_copy = pathlib.Path(args.targetdirectory) / args.filename
+    if working_copy.resolve() == db.resolve():
+        raise ValueError("The working copy must not be the slice itself.")
+
+    logging.basicConfig(
+        filename=pathlib.Path(args.targetdirectory) / "dataslice_indexes.log",
+        filemode="w",
+        format="%(message)s",
+        level=logging.DEBUG,
+    )
+    logging.getLogger().addHandler(logging.StreamHandler())
+
+    with open_sqlite(db, read_only=True) as conn:
+        parameters = query_parameters(conn)
+        before = profile(conn, parameters)
+        selected = select_indexes(conn, parameters)
+
+    logging.info(f"Copying {db} to {working_copy}.")
+    shutil.copy2(db, working_copy)
+
+    with open_sqlite(working_copy) as conn:
+        create_indexes(conn, selected)
+        after = profile(conn, parameters)
+
+    for name in KNOWN_QUERIES:
+        (plan_before, time_before), (plan_after, time_after) = before[name], after[name]
+        logging.info(f"Query '{name}': {time_before:.3f} s -> {time_after:.3f} s")
+        logging.info(f"    plan before: {plan_before}")
+        logging.info(f"    plan after:  {plan_after}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-sd", "--sourcedirectory", default="/path/to/db_file_directory"
+    )
+    parser.add_argument("-fn", "--filename", default="data_UWO_2019-01_2020-01.sqlite")
+    parser.add_argument(
+        "-td", "--targetdirectory", default="/path/to/working_copy_directory"
+    )
+
+    args = parser.parse_args()
+
+    main(args)
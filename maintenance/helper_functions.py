@@ -13,6 +13,8 @@ import ipywidgets as widgets
 from ipywidgets import interact, interactive, fixed, Layout, interact_manual
 import time
 
+from . import datapool_registry
+
 # connection parameters (example)
 
 
@@ -42,34 +44,21 @@ def calculate_total_mins(row, col_name):
 
 def find_most_common_timedelta(timeseries):
     """
-    helper function to find the most common timedelta in a timeseries
+    helper function to find the most common timedelta in a timeseries, in minutes rounded to whole minutes.
+    Of equally common timedeltas the smallest is taken. The timeseries is not modified.
     """
-
-    timeseries["timedelta"] = timeseries["timestamp"] - timeseries["timestamp"].shift(1)
-    timeseries["timedelta_mins"] = timeseries.apply(
-        calculate_total_mins, col_name="timedelta", axis=1
-    )
-    most_common_timedelta = (
-        timeseries.groupby("timedelta_mins")
-        .count()
-        .sort_values("timestamp", ascending=False)
-        .iloc[0]
-        .name
-    )
-
-    return most_common_timedelta
+    timedelta_mins = np.round(timeseries["timestamp"].diff().dt.total_seconds() / 60)
+    counts = timedelta_mins.value_counts()
+    if counts.empty:
+        raise ValueError("at least two timestamps are needed to find a timedelta")
+    return counts.index[counts == counts.max()].min()
 
 
 def extract_main_parameter(parameter_list):
     """
     helper function to extract the main measurement parameter
     """
-    dp = DataPool(to_replace={"parameter": "variable"})
-    all_parameters = dp.parameter.all()
-    main_parameters = all_parameters[
-        all_parameters["description"].str.startswith("Main measurement parameter")
-    ]
-    main_parameters = list(main_parameters["name"])
+    main_parameters = datapool_registry.REGISTRY.main_parameters()
     found_main_parameters = []
     for parameter in parameter_list:
         if parameter in main_parameters:
@@ -282,57 +271,22 @@ def find_all_sensor_groups():
     """
     helper function to find different sensor groups (defined by their prefix bt, bm, bx ...)
     """
-    all_types = []
-    dp = DataPool(to_replace={"parameter": "variable"})
-    for source in list(dp.source.all()["name"]):
-        if source.split("_")[0] in all_types:
-            continue
-        else:
-            all_types.append(source.split("_")[0])
-    return all_types
+    return list(datapool_registry.REGISTRY.groups())
 
 
 def find_nb_of_sensor_within_group(group):
     """
     helper function to find amount of sensors within a group
     """
-    dp = DataPool(to_replace={"parameter": "variable"})
-    counter = 0
-    for source in list(dp.source.all()["name"]):
-        if source.split("_")[0] == group:
-            counter = counter + 1
-    return counter
+    return len(datapool_registry.REGISTRY.groups().get(group, []))
 
 
-def calculate_PSR(
-    source_name,
-    start_date,
-    resolution="M",
-    allow_higher_samplingrates=True,
-    thresh_drop_values=-100000,
-    end_date="",
+def _prepare_PSR_data(
+    source_name, start_date, allow_higher_samplingrates, thresh_drop_values, end_date
 ):
     """
-    function to find the PSR of a sensor. Here PSR is defined as the amount of received packages divided by the
-    expected amount of sent packages if the transmission was allways successfull.
-
-    Parameters
-    ----------
-    source_name : str
-        name of the source of interest
-    start_date : str
-        date that will be considered for calculation of PSR
-    resolution: str
-        Defines what the resolution of the PSR should be. (Yearly: 'Y', Quarterly: 'Q', Monthly: 'M', 'Weekly':'W', Daily:'D')
-        For full specification of available frequencies,
-        please see https://pandas.pydata.org/pandas-docs/stable/user_guide/timeseries.html#offset-aliases.
-    allow_higher_samplingrates : bool
-        Wheter or not higher frequencies than the most occuring sampling frequencies are allowed for calculation of PSR.
-        If set to True, PSR can be higher than 1
-    thresh_drop_values : float
-        which values to ignore when calculating PSR. This feature is not tested and does most likely not work yet.
-    end_date : str
-        data collected after end date will not be considered
+    helper function to load the main parameter of a source and prepare it for the calculation of the PSR.
+    Returns the data with a column day_difference and the most common timedelta in minutes.
     """
     dp = DataPool(to_replace={"parameter": "variable"})
     # get all sensor data from the database
@@ -396,13 +350,13 @@ def calculate_PSR(
         - (parameter_data["timestamp"].shift(1).dt.floor(freq="D"))
     ) / np.timedelta64(1, "D")
 
-    # groupby and count
-    grouped_data = (
-        parameter_data.groupby(pd.Grouper(key="timestamp", axis=0, freq=resolution))
-        .agg({"day_difference": "sum", "value": "count"})
-        .reset_index()
-    )
+    return parameter_data, most_common_timedelta
 
+
+def _normalize_PSR(grouped_data, most_common_timedelta, source_name):
+    """
+    helper function to normalize the package counts of calculate_PSR.
+    """
     # normalize the count
     grouped_data["normalized_count"] = grouped_data.apply(
         normalize_sent_packages, most_common_timedelta=most_common_timedelta, axis=1
@@ -417,6 +371,394 @@ def calculate_PSR(
     return grouped_data_minimal
 
 
+def calculate_PSR(
+    source_name,
+    start_date,
+    resolution="M",
+    allow_higher_samplingrates=True,
+    thresh_drop_values=-100000,
+    end_date="",
+):
+    """
+    function to find the PSR of a sensor. Here PSR is defined as the amount of received packages divided by the
+    expected amount of sent packages if the transmission was allways successfull.
+
+    Parameters
+    ----------
+    source_name : str
+        name of the source of interest
+    start_date : str
+        date that will be considered for calculation of PSR
+    resolution: str
+        Defines what the resolution of the PSR should be. (Yearly: 'Y', Quarterly: 'Q', Monthly: 'M', 'Weekly':'W', Daily:'D')
+        For full specification of available frequencies,
+        please see https://pandas.pydata.org/pandas-docs/stable/user_guide/timeseries.html#offset-aliases.
+    allow_higher_samplingrates : bool
+        Wheter or not higher frequencies than the most occuring sampling frequencies are allowed for calculation of PSR.
+        If set to True, PSR can be higher than 1
+    thresh_drop_values : float
+        which values to ignore when calculating PSR. This feature is not tested and does most likely not work yet.
+    end_date : str
+        data collected after end date will not be considered
+    """
+    parameter_data, most_common_timedelta = _prepare_PSR_data(
+        source_name,
+        start_date,
+        allow_higher_samplingrates,
+        thresh_drop_values,
+        end_date,
+    )
+
+    # groupby and count
+    grouped_data = (
+        parameter_data.groupby(pd.Grouper(key="timestamp", axis=0, freq=resolution))
+        .agg({"day_difference": "sum", "value": "count"})
+        .reset_index()
+    )
+
+    return _normalize_PSR(grouped_data, most_common_timedelta, source_name)
+
+
+# resolutions that calculate_PSR_multi rolls up from the daily counts
+ROLLUP_RESOLUTIONS = ["W", "M", "Q", "Y"]
+
+
+def calculate_PSR_multi(
+    source_name,
+    start_date,
+    resolutions=("Y", "Q", "M", "W", "D"),
+    allow_higher_samplingrates=True,
+    thresh_drop_values=-100000,
+    end_date="",
+):
+    """
+    calculate_PSR for several resolutions at once. The data of the source is loaded and prepared only once,
+    the packages are counted per day and the daily counts are summed up to the resolutions in
+    ROLLUP_RESOLUTIONS. Other resolutions are counted from the packages directly.
+
+    Parameters
+    ----------
+    source_name : str
+        name of the source of interest
+    start_date : str
+        date that will be considered for calculation of PSR
+    resolutions: list
+        the resolutions of the PSR, see calculate_PSR
+    allow_higher_samplingrates : bool
+        Wheter or not higher frequencies than the most occuring sampling frequencies are allowed for calculation of PSR.
+        If set to True, PSR can be higher than 1
+    thresh_drop_values : float
+        which values to ignore when calculating PSR.
+    end_date : str
+        data collected after end date will not be considered
+
+    Returns
+    -------
+    dict with the frame of calculate_PSR for every resolution
+    """
+    parameter_data, most_common_timedelta = _prepare_PSR_data(
+        source_name,
+        start_date,
+        allow_higher_samplingrates,
+        thresh_drop_values,
+        end_date,
+    )
+
+    def count(data, resolution):
+        return data.groupby(pd.Grouper(key="timestamp", axis=0, freq=resolution)).agg(
+            {"day_difference": "sum", "value": "count"}
+        )
+
+    daily = count(parameter_data, "D")
+
+    PSR = {}
+    for resolution in resolutions:
+        if resolution in ROLLUP_RESOLUTIONS:
+            grouped_data = daily.resample(resolution).sum()
+        elif resolution == "D":
+            grouped_data = daily
+        else:
+            grouped_data = count(parameter_data, resolution)
+        PSR[resolution] = _normalize_PSR(
+            grouped_data.reset_index(), most_common_timedelta, source_name
+        )
+    return PSR
+
+
+def _sql_list(values):
+    """
+    helper function to write a list of values as SQL list, e.g. ('a', 'b')
+    """
+    return "({})".format(
+        ", ".join(
+            str(value)
+            if isinstance(value, (int, np.integer))
+            else "'{}'".format(str(value).replace("'", "''"))
+            for value in values
+        )
+    )
+
+
+def _time_filter(start_date, end_date):
+    time_filter = f"t_signal.timestamp >= '{start_date}'"
+    if end_date != "":
+        time_filter += f" AND t_signal.timestamp <= '{end_date}'"
+    return time_filter
+
+
+def find_main_parameters_batch(dp, start_date, end_date="", source_names=None):
+    """
+    find the parameter of every source that calculate_PSR would use: the main measurement parameter
+    that appears first, or the first parameter if the source has no main measurement parameter.
+
+    Parameters
+    ----------
+    dp : DataPool
+        connection to the datapool
+    start_date : str
+        data before start_date is not considered
+    end_date : str
+        data collected after end date will not be considered
+    source_names : list
+        names of the sources, all sources if None
+
+    Returns
+    -------
+    pandas DataFrame with the columns source_name, source_id and variable_id
+    """
+    source_filter = ""
+    if source_names is not None:
+        source_filter = f"AND t_source.name IN {_sql_list(source_names)}"
+    parameters = dp.query_df(
+        f"""
+    SELECT t_source.name AS source_name, t_signal.source_id, t_signal.variable_id,
+        MIN(t_signal.timestamp) AS first_timestamp,
+        t_parameter.description LIKE 'Main measurement parameter%%' AS is_main
+    FROM signal AS t_signal
+    INNER JOIN source AS t_source
+        ON t_signal.source_id = t_source.source_id
+    INNER JOIN variable AS t_parameter
+        ON t_signal.variable_id = t_parameter.variable_id
+    WHERE {_time_filter(start_date, end_date)} {source_filter}
+    GROUP BY t_source.name, t_signal.source_id, t_signal.variable_id, t_parameter.description
+    """
+    )
+    parameters["is_main"] = parameters["is_main"].fillna(False).astype(bool)
+    parameters = parameters.sort_values(
+        ["source_name", "is_main", "first_timestamp", "variable_id"],
+        ascending=[True, False, True, True],
+    ).drop_duplicates(subset="source_name")
+    return parameters[["source_name", "source_id", "variable_id"]].reset_index(
+        drop=True
+    )
+
+
+def most_common_timedelta_per_sensor(data):
+    """
+    the most common timedelta in minutes between consecutive timestamps of every sensor, as
+    find_most_common_timedelta for a single sensor. Of equally common timedeltas the smallest is taken.
+
+    Parameters
+    ----------
+    data : pandas DataFrame
+        with the columns sensor and timestamp, sorted by sensor and timestamp
+
+    Returns
+    -------
+    pandas Series with the most common timedelta (float, in minutes) per sensor
+    """
+    timedelta_mins = np.round(
+        data.groupby("sensor")["timestamp"].diff().dt.total_seconds() / 60
+    )
+    counts = (
+        pd.DataFrame({"sensor": data["sensor"], "timedelta_mins": timedelta_mins})
+        .dropna()
+        .value_counts()
+        .rename("count")
+        .reset_index()
+    )
+    most_common = counts.sort_values(
+        ["sensor", "count", "timedelta_mins"], ascending=[True, False, True]
+    ).drop_duplicates(subset="sensor")
+    return most_common.set_index("sensor")["timedelta_mins"]
+
+
+def _round_to_frequency(timestamps, frequency_mins):
+    """
+    round every timestamp to a multiple of its own frequency (in minutes), as Series.dt.round would
+    do with the frequency of every row (ties to even). Timezone aware timestamps are rounded in their
+    local time and keep their timezone. Timestamps without a positive frequency are not rounded.
+    """
+    tz = timestamps.dt.tz
+    local = timestamps.dt.tz_localize(None) if tz is not None else timestamps
+    ns = local.to_numpy(dtype="datetime64[ns]").view("int64")
+    minutes = frequency_mins.to_numpy(dtype=float)
+    valid = np.isfinite(minutes) & (minutes > 0) & local.notna().to_numpy()
+    unit = np.where(valid, minutes * 60 * 1e9, 1).round().astype("int64")
+    valid &= unit > 0
+    unit[~valid] = 1
+    quotient, remainder = np.divmod(ns, unit)
+    round_up = (2 * remainder > unit) | ((2 * remainder == unit) & (quotient % 2 == 1))
+    rounded = np.where(valid, (quotient + round_up) * unit, ns)
+    rounded = pd.Series(
+        rounded.view("datetime64[ns]"), index=timestamps.index, name=timestamps.name
+    )
+    if tz is not None:
+        rounded = rounded.dt.tz_localize(tz)
+    return rounded
+
+
+def _empty_PSR_batch(return_basis):
+    # the result of calculate_PSR_batch if there is no data
+    empty = pd.DataFrame(columns=["timestamp", "sensor", "normalized_count"])
+    if return_basis:
+        return empty, pd.DataFrame(
+            columns=["source_id", "variable_id", "timedelta_mins"]
+        )
+    return empty
+
+
+def calculate_PSR_batch(
+    start_date,
+    resolution="M",
+    allow_higher_samplingrates=True,
+    thresh_drop_values=-100000,
+    end_date="",
+    source_names=None,
+    basis=None,
+    return_basis=False,
+):
+    """
+    calculate_PSR for many sources at once. Instead of one request per source, the main parameter
+    of all sources is looked up with one query and the timestamps of all sources are loaded with a
+    second one; the PSR is then computed for all sources together with grouped operations.
+
+    Parameters
+    ----------
+    start_date : str
+        date that will be considered for calculation of PSR
+    resolution: str
+        Defines what the resolution of the PSR should be. (Yearly: 'Y', Quarterly: 'Q', Monthly: 'M', 'Weekly':'W', Daily:'D')
+    allow_higher_samplingrates : bool
+        Wheter or not higher frequencies than the most occuring sampling frequencies are allowed for calculation of PSR.
+        If set to True, PSR can be higher than 1
+    thresh_drop_values : float
+        which values to ignore when calculating PSR.
+    end_date : str
+        data collected after end date will not be considered
+    source_names : list
+        names of the sources of interest, all sources if None
+    basis : pandas DataFrame
+        if given, the source_id, variable_id (main parameter) and timedelta_mins (most common timedelta) per
+        source name (index) to calculate the PSR with, instead of finding them in the loaded period. Only the
+        sources in basis are calculated.
+    return_basis : bool
+        whether to return the basis the PSR was calculated with as well
+
+    Returns
+    -------
+    pandas DataFrame with the columns timestamp, sensor and normalized_count (as calculate_PSR) of
+    all sources for which the PSR could be calculated, ordered by sensor and timestamp. With return_basis
+    also the basis of these sources, as the parameter basis.
+    """
+    dp = DataPool(to_replace={"parameter": "variable"})
+    if basis is None:
+        parameters = find_main_parameters_batch(dp, start_date, end_date, source_names)
+    else:
+        parameters = basis.rename_axis("source_name").reset_index()
+    if parameters.empty:
+        return _empty_PSR_batch(return_basis)
+
+    pairs = ", ".join(
+        f"({source_id}, {variable_id})"
+        for source_id, variable_id in zip(
+            parameters["source_id"], parameters["variable_id"]
+        )
+    )
+    data = dp.query_df(
+        f"""
+    SELECT t_source.name AS sensor, t_signal.timestamp, t_signal.value
+    FROM signal AS t_signal
+    INNER JOIN source AS t_source
+        ON t_signal.source_id = t_source.source_id
+    WHERE (t_signal.source_id, t_signal.variable_id) IN ({pairs})
+        AND {_time_filter(start_date, end_date)}
+    ORDER BY t_source.name, t_signal.timestamp
+    """
+    )
+    data["timestamp"] = pd.to_datetime(data["timestamp"])
+    data = data.sort_values(["sensor", "timestamp"], kind="stable")
+
+    # find the most comon timedelta between consecutive packages of every sensor
+    if basis is None:
+        most_common_timedelta = most_common_timedelta_per_sensor(data)
+    else:
+        most_common_timedelta = basis["timedelta_mins"].astype(float)
+        most_common_timedelta.index.name = "sensor"
+    # as calculate_PSR, the PSR of a sensor can not be normalized with a timedelta of 0 minutes
+    not_positive = set(most_common_timedelta.index[~(most_common_timedelta > 0)])
+    if not_positive:
+        warnings.warn(
+            "the most common timedelta is not positive for these sensors: {}".format(
+                sorted(not_positive)
+            )
+        )
+        most_common_timedelta = most_common_timedelta[most_common_timedelta > 0]
+    without_timedelta = (
+        set(data["sensor"]) - set(most_common_timedelta.index) - not_positive
+    )
+    if without_timedelta:
+        warnings.warn(
+            "could not find a most common timedelta for these sensors: {}".format(
+                sorted(without_timedelta)
+            )
+        )
+    data = data[data["sensor"].isin(most_common_timedelta.index)].copy()
+    if data.empty:
+        return _empty_PSR_batch(return_basis)
+    data_timedelta = data["sensor"].map(most_common_timedelta)
+
+    if allow_higher_samplingrates == False:
+        data["timestamp"] = _round_to_frequency(data["timestamp"], data_timedelta)
+        data = data.drop_duplicates(subset=["sensor", "timestamp"])
+
+    data = data[~(data["value"] < thresh_drop_values)]
+
+    # add a column with the difference in days of current and previous date:
+    days = data["timestamp"].dt.floor(freq="D")
+    data = data.assign(
+        day_difference=(days - days.groupby(data["sensor"]).shift(1))
+        / np.timedelta64(1, "D")
+    )
+
+    # groupby and count
+    grouped_data = (
+        data.set_index("timestamp")
+        .groupby("sensor")
+        .resample(resolution)
+        .agg({"day_difference": "sum", "value": "count"})
+        .reset_index()
+    )
+
+    # normalize the count
+    grouped_data["normalized_count"] = grouped_data["value"] / (
+        grouped_data["day_difference"]
+        * 24
+        * 60
+        / grouped_data["sensor"].map(most_common_timedelta)
+    )
+
+    PSR = grouped_data[["timestamp", "sensor", "normalized_count"]]
+    if return_basis:
+        used_basis = (
+            parameters.set_index("source_name")[["source_id", "variable_id"]]
+            .join(most_common_timedelta.rename("timedelta_mins"), how="inner")
+            .loc[lambda used: used.index.isin(data["sensor"])]
+        )
+        return PSR, used_basis
+    return PSR
+
+
 def filter_db_for_boxplot(sensor_group, start, parameter_unit, keyword):
     """
     querry to filter the the database to plot the boxplots.
@@ -1,8 +1,7 @@
 import sys
 
 sys.path.append(r"C:\Users\steineph\DataAnalysis\UWO-Dataanalysis\libs")
-from datapool_client import DataPool
-from UWO_DataAnalysis import helper_functions
+from UWO_DataAnalysis import datapool_registry, helper_functions
 import pandas as pd
 import argparse
 import tqdm
@@ -32,7 +31,6 @@ def make_PSR_Plot(how, frequency, save_directory, start_date="2016-01-01", end_d
     save_directory : str
         directory where the plots will be saved. make sure you pass the path like this : 'C:/... instead of 'C:\...
     """
-    dp = DataPool()
     freq_annot_dict = {"Y": True, "Q": True, "M": False, "W": False, "D": False}
     freq_ShortLong_dict = {
         "Y": "Yearly",
@@ -51,7 +49,7 @@ def make_PSR_Plot(how, frequency, save_directory, start_date="2016-01-01", end_d
         end_date = yesterday
 
     if how == "1_Sensor_x_Frequencies":
-        for source in tqdm.tqdm(list(dp.source.all()["name"])):
+        for source in tqdm.tqdm(datapool_registry.REGISTRY.source_names()):
             savepath = os.path.join(save_directory, "{}".format(source.split("_")[0]))
             if not os.path.exists(savepath):
                 os.makedirs(savepath)
@@ -67,14 +65,16 @@ def make_PSR_Plot(how, frequency, save_directory, start_date="2016-01-01", end_d
                 grouped_data = []
                 grouped_data_long = []
 
+                # load the data of the source once for all frequencies
+                PSR_data = helper_functions.calculate_PSR_multi(
+                    source_name=source,
+                    start_date=start_date,
+                    resolutions=frequency,
+                    allow_higher_samplingrates=False,
+                    end_date=end_date,
+                )
                 for freq in frequency:
-                    grouped_data_x = helper_functions.calculate_PSR(
-                        source_name=source,
-                        start_date=start_date,
-                        resolution=freq,
-                        allow_higher_samplingrates=False,
-                        end_date=end_date,
-                    )
+                    grouped_data_x = PSR_data[freq]
                     grouped_data.append(grouped_data_x)
 
                     grouped_data_long_x = pd.pivot(
@@ -119,7 +119,15 @@ def make_PSR_Plot(how, frequency, save_directory, start_date="2016-01-01", end_d
                 continue
 
     elif how == "x_Sensors_1_Frequency":
-        df_grouped = pd.DataFrame()
+        all_sources = datapool_registry.REGISTRY.source_names()
+        # the PSR of all sensors at once
+        PSR_data = helper_functions.calculate_PSR_batch(
+            start_date=start_date,
+            resolution=frequency[0],
+            allow_higher_samplingrates=False,
+            end_date=end_date,
+        )
+        calculated = set(PSR_data["sensor"])
         sensor_groups = helper_functions.find_all_sensor_groups()
         for group in sensor_groups:
             savepath = os.path.join(save_directory, group)
@@ -131,26 +139,19 @@ def make_PSR_Plot(how, frequency, save_directory, start_date="2016-01-01", end_d
 
             # define size of the plot
             fig, ax = plt.subplots(figsize=(25, nb_sensors_within_group * 1.5))
-            dp = DataPool()
-            for source in tqdm.tqdm(list(dp.source.all()["name"])):
-                try:
-                    if source.split("_")[0] == group:
-                        PSR_data = helper_functions.calculate_PSR(
-                            source_name=source,
-                            start_date=start_date,
-                            resolution=frequency[0],
-                            allow_higher_samplingrates=False,
-                            end_date=end_date,
-                        )
-                        PSR_data_long = pd.pivot(
-                            PSR_data,
-                            index="sensor",
-                            columns="timestamp",
-                            values="normalized_count",
-                        )
-                        df_grouped = df_grouped.append(PSR_data_long)
-                except:
+            group_sources = [
+                source for source in all_sources if source.split("_")[0] == group
+            ]
+            for source in group_sources:
+                if source not in calculated:
                     print(f"skipped this sensor: {source}")
+            group_sources = [source for source in group_sources if source in calculated]
+            df_grouped = pd.pivot(
+                PSR_data[PSR_data["sensor"].isin(group_sources)],
+                index="sensor",
+                columns="timestamp",
+                values="normalized_count",
+            ).reindex(group_sources)
 
             heatmap_plot = sns.heatmap(
                 data=df_grouped,
@@ -0,0 +1,135 @@
+"""
+Online detection of PSR drops of a sensor.
+
+check_sensors flags a sensor when the PSR of the current week is more than 2 standard deviations below the mean
+of the previous weeks, leaving out previous weeks that were strong outliers (z score of at most -3). The detector
+keeps the running mean and variance of the accepted PSR values (Welford's algorithm), so that every new value is
+evaluated and added with constant work, in the weekly check as well as in a loop over newly arriving values.
+"""
+import math
+
+import numpy as np
+
+
+def not_outliers(values, outlier_threshold=-3):
+    """
+    mask of the values whose z score among all values is above outlier_threshold. If the standard deviation is 0,
+    no value is above, as with scipy.stats.zscore.
+    """
+    values = np.asarray(values, dtype=float)
+    if len(values) == 0:
+        return np.zeros(0, dtype=bool)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        z_scores = (values - values.mean()) / values.std()
+    return z_scores > outlier_threshold
+
+
+class PSRDropDetector:
+    """
+    Running statistics of the PSR of one sensor.
+
+    Parameters
+    ----------
+    threshold : float
+        z score below which a PSR value is a drop
+    outlier_threshold : float
+        z score at or below which a PSR value is not added to the statistics
+    alpha : float
+        if given, the mean and variance are exponentially weighted with this smoothing factor (EWMA) instead of
+        being the mean and variance of all accepted values, so that the detector follows slow changes of the PSR
+
+    Attributes
+    ----------
+    n : int
+        number of accepted values
+    mean : float
+        mean of the accepted values, nan if there are none
+    """
+
+    def __init__(self, threshold=-2, outlier_threshold=-3, alpha=None):
+        self.threshold = threshold
+        self.outlier_threshold = outlier_threshold
+        self.alpha = alpha
+        self.n = 0
+        self.mean = math.nan
+        self._m2 = 0.0
+
+    @classmethod
+    def from_history(cls, values, **kwargs):
+        """
+        detector of the previous PSR values of a sensor. As check_sensors did before, the outliers are found with
+        the z scores of all previous values and left out.
+        """
+        detector = cls(**kwargs)
+        values = np.asarray(values, dtype=float)
+        for value in values[not_outliers(values, detector.outlier_threshold)]:
+            detector._add(value)
+        return detector
+
+    @property
+    def std(self):
+        """
+        standard deviation of the accepted values (population, as scipy.stats.zscore)
+        """
+        if self.n == 0:
+            return math.nan
+        if self.alpha is not None:
+            return math.sqrt(self._m2)
+        return math.sqrt(self._m2 / self.n)
+
+    def _add(self, value):
+        self.n += 1
+        if self.n == 1:
+            self.mean = value
+            self._m2 = 0.0
+        elif self.alpha is not None:
+            # _m2 is the exponentially weighted variance
+            diff = value - self.mean
+            self.mean += self.alpha * diff
+            self._m2 = (1 - self.alpha) * (self._m2 + self.alpha * diff**2)
+        else:
+            diff = value - self.mean
+            self.mean += diff / self.n
+            self._m2 += diff * (value - self.mean)
+
+    def statistics_with(self, value):
+        """
+        mean and standard deviation of the accepted values and value. With alpha, of the accepted values only.
+        """
+        if self.alpha is not None:
+            return self.mean, self.std
+        n = self.n + 1
+        if self.n == 0:
+            return value, 0.0
+        diff = value - self.mean
+        mean = self.mean + diff / n
+        return mean, math.sqrt((self._m2 + diff * (value - mean)) / n)
+
+    def z_score(self, value):
+        """
+        z score of value among the accepted values and value itself, as check_sensors calculates the z score of
+        the current week. With alpha, among the accepted values only. nan if the standard deviation is 0.
+        """
+        mean, std = self.statistics_with(value)
+        if std == 0 or math.isnan(std):
+            return math.nan
+        return (value - mean) / std
+
+    def evaluate(self, value):
+        """
+        z score of value and wheter it is a drop, without adding it to the statistics
+        """
+        z_score = self.z_score(value)
+        return z_score, z_score < self.threshold
+
+    def update(self, value):
+        """
+        evaluates value and adds it to the statistics unless it is an outlier, for newly arriving PSR values
+        """
+        z_score, is_drop = self.evaluate(value)
+        if not math.isfinite(value):
+            return z_score, is_drop
+        # the z score is nan as long as all accepted values are equal
+        if not z_score <= self.outlier_threshold:
+            self._add(value)
+        return z_score, is_drop
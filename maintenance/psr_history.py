@@ -0,0 +1,275 @@
+"""
+Persistent history of the weekly PSR per sensor, used by check_sensors.
+
+The PSR of a completed week does not change anymore. Instead of calculating the PSR of the last 16 weeks on
+every run, the completed weeks are stored in a SQLite file and only the weeks after the last stored one
+are calculated from the datapool. Up to which week the PSR of a sensor was calculated is kept separately, so
+that a sensor without data in the last weeks is not calculated from its last stored week again.
+
+The PSR depends on the main parameter of a sensor and is normalized with its most common timedelta between
+packages (see helper_functions.calculate_PSR_batch), both found in the loaded period. They are stored with the
+sensor (its basis) when its whole period is calculated and used again for the following weeks, so that stored
+and new weeks are calculated alike. Once the basis was calculated before the start of the checked period, the
+whole period of the sensor is calculated again.
+
+A week is labelled with its last day (Sunday), as by pandas resample("W"). A week is only stored when it is
+complete, i.e. its end is before the end of the calculated period and the day before its Monday was loaded as
+well, because the PSR is normalized with the day differences between consecutive packages. The whole period is
+therefore calculated from the Sunday before the week of its start.
+
+All timestamps are stored as naive UTC, timezone aware timestamps are converted and naive ones are taken as UTC.
+"""
+import contextlib
+import sqlite3
+
+import pandas as pd
+
+
+HISTORY_SCHEMA = """
+CREATE TABLE IF NOT EXISTS weekly_psr (
+    sensor TEXT NOT NULL,
+    week TEXT NOT NULL,
+    normalized_count REAL,
+    PRIMARY KEY (sensor, week)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS history_state (
+    sensor TEXT PRIMARY KEY,
+    complete_until TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS sensor_basis (
+    sensor TEXT PRIMARY KEY,
+    source_id INTEGER NOT NULL,
+    variable_id INTEGER NOT NULL,
+    timedelta_mins REAL NOT NULL,
+    calculated_until TEXT NOT NULL
+)
+"""
+
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+BASIS_COLUMNS = ["source_id", "variable_id", "timedelta_mins"]
+
+
+def to_utc(timestamps):
+    """
+    timestamps (a single one or a Series) as naive UTC
+    """
+    if isinstance(timestamps, pd.Series):
+        timestamps = pd.to_datetime(timestamps)
+        if timestamps.dt.tz is not None:
+            return timestamps.dt.tz_convert("UTC").dt.tz_localize(None)
+        return timestamps
+    timestamp = pd.Timestamp(timestamps)
+    if timestamp.tz is not None:
+        return timestamp.tz_convert("UTC").tz_localize(None)
+    return timestamp
+
+
+def period_start(start_date):
+    """
+    the Sunday before the week of start_date, from which the whole period since start_date is calculated
+    """
+    day = to_utc(start_date).normalize()
+    return day - pd.Timedelta(days=day.weekday() + 1)
+
+
+def last_complete_week(end_date):
+    """
+    the Sunday of the last week that ends before end_date, the current time if empty
+    """
+    end = to_utc(end_date) if end_date != "" else to_utc(pd.Timestamp.now(tz="UTC"))
+    last_day = (end + pd.Timedelta(seconds=1) - pd.Timedelta(days=1)).normalize()
+    return last_day - pd.Timedelta(days=(last_day.weekday() + 1) % 7)
+
+
+class PSRHistory:
+    """
+    Weekly PSR of the sensors stored in a SQLite file.
+
+    Parameters
+    ----------
+    db_file : str
+        SQLite file of the history, created if it does not exist
+    """
+
+    def __init__(self, db_file):
+        self.db_file = str(db_file)
+        with self._connect() as conn:
+            conn.executescript(HISTORY_SCHEMA)
+
+    @contextlib.contextmanager
+    def _connect(self):
+        # one connection per call, so that the history can be used by several threads
+        conn = sqlite3.connect(self.db_file, timeout=60)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def complete_until(self, source_names):
+        """
+        the last week per sensor up to which the PSR was calculated, sensors without history are missing
+        """
+        placeholders = ", ".join("?" * len(source_names))
+        with self._connect() as conn:
+            rows = conn.execute(
+                f"SELECT sensor, complete_until FROM history_state WHERE sensor IN ({placeholders})",
+                list(source_names),
+            ).fetchall()
+        return {sensor: pd.Timestamp(week) for sensor, week in rows}
+
+    def basis(self, source_names):
+        """
+        the stored basis per sensor (source_id, variable_id, timedelta_mins and calculated_until), sensors
+        without basis are missing
+        """
+        placeholders = ", ".join("?" * len(source_names))
+        with self._connect() as conn:
+            rows = conn.execute(
+                f"""
+                SELECT sensor, source_id, variable_id, timedelta_mins, calculated_until
+                FROM sensor_basis WHERE sensor IN ({placeholders})
+                """,
+                list(source_names),
+            ).fetchall()
+        return {
+            sensor: {
+                "source_id": source_id,
+                "variable_id": variable_id,
+                "timedelta_mins": timedelta_mins,
+                "calculated_until": pd.Timestamp(calculated_until),
+            }
+            for sensor, source_id, variable_id, timedelta_mins, calculated_until in rows
+        }
+
+    def plan(self, source_names, start_date):
+        """
+        from when and with which basis the PSR of every sensor has to be calculated to complete its history
+        since start_date.
+
+        Returns
+        -------
+        dict
+            (fetch_start, basis) per sensor. fetch_start is the last completed week of the sensor and basis its
+            stored basis, or period_start(start_date) and None if the whole period has to be calculated: if the
+            sensor has no history or basis, its history ends before the period or its basis was calculated before
+            start_date.
+        """
+        start = to_utc(start_date)
+        full_start = period_start(start)
+        complete_until = self.complete_until(source_names)
+        basis = self.basis(source_names)
+        plan = {}
+        for sensor in source_names:
+            until = complete_until.get(sensor)
+            sensor_basis = basis.get(sensor)
+            if (
+                until is None
+                or sensor_basis is None
+                or until < full_start
+                or sensor_basis["calculated_until"] < start
+            ):
+                plan[sensor] = (full_start, None)
+            else:
+                plan[sensor] = (until, sensor_basis)
+        return plan
+
+    def read(self, source_names, start_date):
+        """
+        the stored PSR of the sensors since start_date, as returned by helper_functions.calculate_PSR
+        """
+        placeholders = ", ".join("?" * len(source_names))
+        with self._connect() as conn:
+            PSR = pd.read_sql_query(
+                f"""
+                SELECT week AS timestamp, sensor, normalized_count
+                FROM weekly_psr
+                WHERE sensor IN ({placeholders}) AND week >= ?
+                ORDER BY sensor, week
+                """,
+                conn,
+                params=list(source_names)
+                + [to_utc(start_date).strftime(TIMESTAMP_FORMAT)],
+            )
+        PSR["timestamp"] = pd.to_datetime(PSR["timestamp"])
+        PSR["normalized_count"] = PSR["normalized_count"].astype(float)
+        return PSR
+
+    def append(self, PSR):
+        """
+        stores the weekly PSR (columns timestamp, sensor and normalized_count), existing weeks are replaced
+        """
+        rows = zip(
+            PSR["sensor"],
+            to_utc(PSR["timestamp"]).dt.strftime(TIMESTAMP_FORMAT),
+            PSR["normalized_count"].astype(float),
+        )
+        with self._connect() as conn:
+            conn.executemany("INSERT OR REPLACE INTO weekly_psr VALUES (?, ?, ?)", rows)
+        return len(PSR)
+
+    def update(
+        self, source_name, new_PSR, start_date, end_date, fetch_start, basis=None
+    ):
+        """
+        stores the completed weeks of a newly calculated PSR and returns the history of the sensor.
+
+        Parameters
+        ----------
+        source_name : str
+            name of the sensor
+        new_PSR : pandas DataFrame
+            weekly PSR of the sensor calculated from fetch_start up to end_date
+        start_date : str
+            first date of the returned history
+        end_date : str
+            last date of the calculated PSR, the current time if empty
+        fetch_start : str
+            first date of the calculated PSR, as given by plan
+        basis : dict
+            source_id, variable_id and timedelta_mins the PSR was calculated with, stored if given
+
+        Returns
+        -------
+        pandas DataFrame
+            the stored PSR since start_date followed by the weeks of new_PSR that are not complete yet, i.e. the
+            current week, ordered by timestamp
+        """
+        complete_until = self.complete_until([source_name]).get(source_name)
+        fetch_start = to_utc(fetch_start)
+        last_week = last_complete_week(end_date)
+
+        new_PSR = new_PSR[new_PSR["sensor"] == source_name].assign(
+            timestamp=lambda PSR: to_utc(PSR["timestamp"])
+        )
+        completed = (new_PSR["timestamp"] - pd.Timedelta(days=6) > fetch_start) & (
+            new_PSR["timestamp"] <= last_week
+        )
+        self.append(new_PSR[completed])
+        with self._connect() as conn:
+            if complete_until is None or last_week > complete_until:
+                conn.execute(
+                    "INSERT OR REPLACE INTO history_state VALUES (?, ?)",
+                    (source_name, last_week.strftime(TIMESTAMP_FORMAT)),
+                )
+            if basis is not None:
+                conn.execute(
+                    "INSERT OR REPLACE INTO sensor_basis VALUES (?, ?, ?, ?, ?)",
+                    (
+                        source_name,
+                        int(basis["source_id"]),
+                        int(basis["variable_id"]),
+                        float(basis["timedelta_mins"]),
+                        last_week.strftime(TIMESTAMP_FORMAT),
+                    ),
+                )
+
+        PSR = pd.concat(
+            [
+                self.read([source_name], start_date),
+                new_PSR[new_PSR["timestamp"] > last_week],
+            ],
+            ignore_index=True,
+        )
+        return PSR.sort_values("timestamp", kind="stable").reset_index(drop=True)
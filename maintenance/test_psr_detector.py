@@ -0,0 +1,139 @@
+"""
+Tests of psr_detector against the z scores check_sensors calculated with scipy.stats.zscore before.
+"""
+import math
+
+import numpy as np
+import pytest
+
+from maintenance import psr_detector
+
+
+def reference_zscore(values):
+    # scipy.stats.zscore of a 1d array: population standard deviation, nan if it is 0
+    values = np.asarray(values, dtype=float)
+    if len(values) == 0:
+        return values
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return (values - values.mean()) / values.std()
+
+
+def reference_check(values):
+    # the former PSR_Sensor.calculate_z_score_PSR: the previous weeks with a z score of at most -3 are left out,
+    # the current week is a drop if its z score among the remaining weeks and itself is below -2
+    values = np.asarray(values, dtype=float)
+    previous, current = values[:-1], values[-1]
+    accepted = previous[reference_zscore(previous) > -3]
+    old_mean = accepted.mean() if len(accepted) else math.nan
+    z_scores = reference_zscore(np.append(accepted, current))
+    return old_mean, accepted, z_scores, z_scores[-1] < -2
+
+
+def detector_check(values):
+    # the same check with the detector, as check_sensors calculates it now
+    values = np.asarray(values, dtype=float)
+    previous, current = values[:-1], values[-1]
+    detector = psr_detector.PSRDropDetector.from_history(previous)
+    z_score, is_suspicious = detector.evaluate(current)
+    accepted = previous[psr_detector.not_outliers(previous)]
+    mean, std = detector.statistics_with(current)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        z_scores = (np.append(accepted, current) - mean) / std
+    z_scores[-1] = z_score
+    return detector.mean, accepted, z_scores, is_suspicious
+
+
+HISTORIES = {
+    "steady": [0.98, 1.0, 0.99, 1.0, 0.97, 1.0, 0.99, 0.98, 1.0, 0.99],
+    "drop": [0.98, 1.0, 0.99, 1.0, 0.97, 1.0, 0.99, 0.98, 1.0, 0.6],
+    "historic_outlier": [0.98, 1.0, 0.99, 0.0, 0.97, 1.0, 0.99, 0.98, 1.0, 0.95],
+    "rising": [0.5, 0.55, 0.6, 0.65, 0.7, 0.75, 0.8, 0.85, 0.9, 0.95],
+    "two_weeks": [0.9, 0.5],
+    "noisy": [0.7, 1.1, 0.8, 1.2, 0.9, 0.6, 1.0, 1.3, 0.75, 0.4],
+}
+
+
+@pytest.fixture(params=sorted(HISTORIES))
+def history(request):
+    return np.array(HISTORIES[request.param])
+
+
+def assert_same_check(values):
+    old_mean, accepted, z_scores, is_suspicious = reference_check(values)
+    new_mean, new_accepted, new_z_scores, new_is_suspicious = detector_check(values)
+    np.testing.assert_allclose(new_mean, old_mean, equal_nan=True)
+    np.testing.assert_array_equal(new_accepted, accepted)
+    np.testing.assert_allclose(new_z_scores, z_scores, atol=1e-9, equal_nan=True)
+    assert new_is_suspicious == is_suspicious
+
+
+def test_fixture_histories(history):
+    assert_same_check(history)
+
+
+def test_drop_is_suspicious():
+    _, is_suspicious = psr_detector.PSRDropDetector.from_history(
+        HISTORIES["drop"][:-1]
+    ).evaluate(HISTORIES["drop"][-1])
+    assert is_suspicious
+
+
+@pytest.mark.parametrize("seed", range(50))
+def test_random_histories(seed):
+    rng = np.random.default_rng(seed)
+    values = rng.normal(0.9, rng.uniform(0.01, 0.2), rng.integers(2, 20))
+    if seed % 3 == 0:
+        values[-1] = rng.uniform(0, 0.5)
+    if seed % 4 == 0 and len(values) > 3:
+        values[rng.integers(0, len(values) - 1)] = 0
+    assert_same_check(values)
+
+
+@pytest.mark.parametrize("current", [1.0, 0.2])
+def test_std_zero(current):
+    # all previous weeks are equal, so their z scores are nan and none of them is accepted
+    values = [1.0] * 8 + [current]
+    assert_same_check(values)
+    detector = psr_detector.PSRDropDetector.from_history(values[:-1])
+    assert detector.n == 0
+    z_score, is_suspicious = detector.evaluate(current)
+    assert math.isnan(z_score)
+    assert not is_suspicious
+
+
+def test_std_zero_with_current():
+    # the accepted previous weeks and the current week are equal
+    detector = psr_detector.PSRDropDetector(outlier_threshold=-math.inf)
+    for value in [1.0, 1.0, 1.0]:
+        detector._add(value)
+    z_score, is_suspicious = detector.evaluate(1.0)
+    assert math.isnan(z_score)
+    assert not is_suspicious
+
+
+def test_all_previous_weeks_rejected():
+    values = [0.5, 0.5, 0.5, 0.5, 0.1]
+    previous = np.array(values[:-1])
+    assert not psr_detector.not_outliers(previous).any()
+    assert_same_check(values)
+    detector = psr_detector.PSRDropDetector.from_history(previous)
+    assert detector.n == 0
+    assert math.isnan(detector.mean)
+
+
+def test_single_week():
+    assert_same_check([0.8])
+    detector = psr_detector.PSRDropDetector.from_history([])
+    z_score, is_suspicious = detector.evaluate(0.8)
+    assert math.isnan(z_score)
+    assert not is_suspicious
+
+
+def test_update_matches_from_history():
+    # without outliers, adding the values one by one gives the statistics of all values
+    values = HISTORIES["noisy"]
+    detector = psr_detector.PSRDropDetector()
+    for value in values:
+        detector.update(value)
+    np.testing.assert_allclose(detector.mean, np.mean(values))
+    np.testing.assert_allclose(detector.std, np.std(values))
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+
+
+"""Compare the heatmap preparation of figure_4_right with the former row-wise
+implementation on synthetic weekly counts.
+
+Run from the repository root with python -m paper.benchmark_figure_4_right.
+
+"""
+
+
+import argparse
+import timeit
+
+import numpy as np
+import pandas as pd
+
+from . import figure_4_right
+
+
+def legacy_exclude_data(data, exclude_list):
+    to_delete = []
+    for idx, name in data.source_name.items():
+        if name in exclude_list:
+            to_delete.append(idx)
+    return data.drop(index=to_delete).reset_index(drop=True)
+
+
+def legacy_get_highest_counts(data):
+    return data.sort_values(
+        ["source_name", "value_count"], ascending=False
+    ).drop_duplicates(subset=["source_name", "date_trunc"], keep="first")
+
+
+def legacy_normalize_matrix(data):
+    return data.apply(
+        lambda x: x / x.max(),
+        axis=0,
+    )
+
+
+def synthetic_counts(
+    n_sources: int, n_weeks: int, n_variables: int = 3, seed: int = 0
+) -> pd.DataFrame:
+    """Weekly counts as returned by count_cube.heatmap_counts, with gaps and tied counts."""
+    rng = np.random.default_rng(seed)
+    weeks = pd.date_range("2019-01-07", periods=n_weeks, freq="7D")
+    index = pd.MultiIndex.from_product(
+        [
+            [f"b{'tlfn'[i % 4]}_dl{i:03d}" for i in range(n_sources)],
+            [f"variable_{i}" for i in range(n_variables)],
+            weeks,
+        ],
+        names=["source_name", "variable_name", "date_trunc"],
+    )
+    data = index.to_frame(index=False)
+    data["value_count"] = rng.choice([2016, 4032, 10080], size=len(data)) - (
+        rng.integers(0, 5, size=len(data)) * rng.integers(0, 2, size=len(data))
+    )
+    data = data.sample(frac=0.9, random_state=seed).reset_index(drop=True)
+    return data[["value_count", "variable_name", "source_name", "date_trunc"]]
+
+
+def prepare(data, exclude_list, exclude_data, get_highest_counts, normalize_matrix):
+    data = exclude_data(data, exclude_list)
+    pivot = figure_4_right.format_time_to_source(get_highest_counts(data))
+    return normalize_matrix(pivot).fillna(0)
+
+
+def main(args: argparse.Namespace) -> None:
+    data = synthetic_counts(args.sources, args.weeks)
+    exclude_list = (
+        data["source_name"].drop_duplicates().sample(frac=0.1, random_state=0).tolist()
+    )
+
+    stages = {
+        "legacy": (
+            legacy_exclude_data,
+            legacy_get_highest_counts,
+            legacy_normalize_matrix,
+        ),
+        "vectorized": (
+            figure_4_right.exclude_data,
+            figure_4_right.get_highest_counts,
+            figure_4_right.normalize_matrix,
+        ),
+    }
+
+    pd.testing.assert_frame_equal(
+        legacy_get_highest_counts(data), figure_4_right.get_highest_counts(data)
+    )
+    pd.testing.assert_frame_equal(
+        prepare(data, exclude_list, *stages["legacy"]),
+        prepare(data, exclude_list, *stages["vectorized"]),
+    )
+
+    for name, functions in stages.items():
+        seconds = min(
+            timeit.repeat(
+                lambda: prepare(data, exclude_list, *functions),
+                number=1,
+                repeat=args.repeat,
+            )
+        )
+        print(
+            f"{name:>10}: {seconds:.3f} s "
+            f"({args.sources} sources x {args.weeks} weeks, {len(data)} rows)"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-s", "--sources", type=int, default=500)
+    parser.add_argument("-w", "--weeks", type=int, default=156)
+    parser.add_argument("-r", "--repeat", type=int, default=3)
+
+    args = parser.parse_args()
+
+    main(args)
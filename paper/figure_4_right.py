@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 
 
+import argparse
 import pathlib
 import contextlib
 import sqlite3
@@ -10,44 +11,41 @@ import pandas as pd
 import plotly.graph_objs as go
 import plotly.subplots as subp
 
+from dataaccess import count_cube, result_cache
 
-HEATMAP_QUERY = f"""
-WITH count_table AS (
-SELECT
-count(variable_id) AS count,
-variable_id,
-source_id,
-strftime('%Y-%m-%d', timestamp, 'weekday 0', '-6 days') AS date_trunc
-FROM signal
-GROUP BY
-strftime('%Y-%m-%d', timestamp, 'weekday 0', '-6 days'),
-variable_id,
-source_id
+
+# the weekly counts are computed by count_cube.heatmap_counts and not by a query, so
+# their cached result is keyed by the version and the queries of the count cube
+HEATMAP_CACHE_KEY = "\n".join(
+    [
+        "figure_4_right.heatmap_counts",
+        f"count_cube version {count_cube.CUBE_VERSION}",
+        count_cube.CUBE_SCHEMA,
+        count_cube.DAILY_DELTA_QUERY,
+        count_cube.UPSERT_QUERY,
+        repr(count_cube.GRAIN_PERIODS),
+    ]
 )
-SELECT
-count_table.count AS value_count,
-variable.name AS variable_name,
-source.name AS source_name,
-count_table.date_trunc AS date_trunc
-FROM count_table
-INNER JOIN variable ON variable.variable_id = count_table.variable_id
-INNER JOIN source ON source.source_id = count_table.source_id
-ORDER BY date_trunc DESC;
-"""
 
 
 def exclude_data(data, exclude_list):
-    to_delete = []
-    for idx, name in data.source_name.items():
-        if name in exclude_list:
-            to_delete.append(idx)
-    return data.drop(index=to_delete).reset_index(drop=True)
+    return data[~data["source_name"].isin(exclude_list)].reset_index(drop=True)
 
 
 def get_highest_counts(data):
-    return data.sort_values(
-        ["source_name", "value_count"], ascending=False
-    ).drop_duplicates(subset=["source_name", "date_trunc"], keep="first")
+    """The row with the highest count of every source and week.
+
+    Of several rows with the same highest count the first one is kept, the result
+    is ordered by source_name and value_count, both descending.
+
+    """
+    keys = ["source_name", "date_trunc"]
+    highest = data.groupby(keys, sort=False)["value_count"].transform("max")
+    return (
+        data[data["value_count"] == highest]
+        .drop_duplicates(subset=keys, keep="first")
+        .sort_values(["source_name", "value_count"], ascending=False, kind="stable")
+    )
 
 
 def format_time_to_source(highest_values):
@@ -83,10 +81,7 @@ def get_plot_name_of_single_source(name):
 
 
 def normalize_matrix(data):
-    return data.apply(
-        lambda x: x / x.max(),
-        axis=0,
-    )
+    return data / data.max()
 
 
 def group_main_heatmap(heatmap_main):
@@ -227,28 +222,43 @@ def _query_df(conn, sql_query):
     )
 
 
-def query(db_file: pathlib.PosixPath, sql_query: str):
+def query(db_file: pathlib.PosixPath, sql_query: str, cache_dir: pathlib.Path = None):
+    if cache_dir is not None:
+        return result_cache.ResultCache(cache_dir).get_or_run(
+            db_file, sql_query, None, lambda: query(db_file, sql_query)
+        )
+
     with open_sqlite(db_file) as conn:
         return _query_df(conn, sql_query)
 
 
+def heatmap_counts(
+    dbs: list[pathlib.Path], cube_directory: pathlib.Path = None
+) -> pd.DataFrame:
+    data = count_cube.heatmap_counts(dbs, cube_directory)
+    data["date_trunc"] = pd.to_datetime(data["date_trunc"], format="%Y-%m-%d")
+    return data
+
+
 def main(
     source_directory: pathlib.Path,
-    filename: str,
+    filenames: list[str],
     clfile: pathlib.Path,
     target_directory: pathlib.Path,
-    reload_data: bool,
+    cache_directory: pathlib.Path,
+    reload: bool = False,
+    cube_directory: pathlib.Path = None,
 ) -> None:
-    if reload_data:
-        db = source_directory / filename
-        data = query(db, HEATMAP_QUERY)
-        data.to_csv(target_directory / "heatmap_data_1.csv", index=False)
-    else:
-        data = pd.read_csv(target_directory / "heatmap_data_3.csv")
-        data = data.append(pd.read_csv(target_directory / "heatmap_data_2.csv"))
-        data = data.append(pd.read_csv(target_directory / "heatmap_data_1.csv"))
-
-    data["date_trunc"] = pd.to_datetime(data["date_trunc"], format="%Y-%m-%d")
+    dbs = [source_directory / filename for filename in filenames]
+    # cached until one of the slices or the count cube changes, computed anew if reload.
+    # The count cubes are kept in cube_directory, next to the slices if None.
+    data = result_cache.ResultCache(cache_directory).get_or_run(
+        dbs,
+        HEATMAP_CACHE_KEY,
+        None,
+        lambda: heatmap_counts(dbs, cube_directory),
+        refresh=reload,
+    )
 
     highest = get_highest_counts(data)
     pivot = format_time_to_source(highest)
@@ -294,6 +304,21 @@ def main(
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-r",
+        "--reload",
+        action="store_true",
+        help="compute the weekly counts anew instead of using the cached ones",
+    )
+    parser.add_argument(
+        "-cd",
+        "--cubedirectory",
+        default=None,
+        help="directory of the count cubes, target directory/cubes if not given",
+    )
+    args = parser.parse_args()
+
     source_directory = pathlib.Path(
         "Q:/Abteilungsprojekte/eng/SWWData/2015_fehraltorf/uwo_data_slices"
     )
@@ -301,7 +326,11 @@ if __name__ == "__main__":
         "C:/Users/dischand/VisualStudioProjects/data/processed"
     )
 
-    filename = "data_UWO_2019-01_2020-01.sqlite"
+    filenames = [
+        "data_UWO_2019-01_2020-01.sqlite",
+        "data_UWO_2020-01_2021-01.sqlite",
+        "data_UWO_2021-01_2022-01.sqlite",
+    ]
 
     package_directory = pathlib.Path(
         "C:/Users/dischand/switchdrive/UWO/Arbeiten und Artikel/UWO_Data_paper/_dataslice/_upload"
@@ -309,4 +338,17 @@ if __name__ == "__main__":
     cl_file = "package_information.csv"
     clfile = package_directory / cl_file
 
-    main(source_directory, filename, clfile, target_directory, reload_data=False)
+    cache_directory = target_directory / "cache"
+    # the slices on the share are only read, the count cubes are kept locally
+    cube_directory = pathlib.Path(args.cubedirectory or target_directory / "cubes")
+    cube_directory.mkdir(parents=True, exist_ok=True)
+
+    main(
+        source_directory,
+        filenames,
+        clfile,
+        target_directory,
+        cache_directory,
+        reload=args.reload,
+        cube_directory=cube_directory,
+    )
@@ -8,6 +8,8 @@ import sqlite3
 
 import pandas as pd
 
+from dataaccess import result_cache
+
 
 SOURCES = [
     "bl_ceaf0_rub_morg",
@@ -95,7 +97,12 @@ def open_sqlite(db_file):
         conn.close()
 
 
-def query(db_file: pathlib.PosixPath, sql_query: str):
+def query(db_file: pathlib.PosixPath, sql_query: str, cache_dir: pathlib.Path = None):
+    if cache_dir is not None:
+        return result_cache.ResultCache(cache_dir).get_or_run(
+            db_file, sql_query, None, lambda: query(db_file, sql_query)
+        )
+
     with open_sqlite(db_file) as conn:
         return pd.read_sql_query(
             sql_query,
@@ -103,7 +110,7 @@ def query(db_file: pathlib.PosixPath, sql_query: str):
         )
 
 
-def main(source_directory, filename, target_directory):
+def main(source_directory, filename, target_directory, cache_directory=None):
     db = source_directory / filename
 
     sql_query = f"""
@@ -111,7 +118,7 @@ def main(source_directory, filename, target_directory):
     FROM source
     INNER JOIN source_type ON source_type.source_type_id = source.source_type_id 
     """
-    res = query(db, sql_query)
+    res = query(db, sql_query, cache_dir=cache_directory)
 
     res.to_csv(target_directory / "source_types.csv")
 
@@ -126,4 +133,6 @@ if __name__ == "__main__":
 
     filename = "data_UWO_2019-01_2020-01.sqlite"
 
-    main(source_directory, filename, target_directory)
+    cache_directory = target_directory / "cache"
+
+    main(source_directory, filename, target_directory, cache_directory)